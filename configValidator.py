@@ -1,7 +1,9 @@
 import json
 import copy
+import hashlib
+import collections
 
-from fakeMachineDriver import fakeDeviceDrivers
+from driverRegistry import loadDriverRegistry
 
 machineConfigRules = {
     "requiredKeywords": ["name", "variables", "measurers", "effectors"],
@@ -10,18 +12,19 @@ machineConfigRules = {
 
 variableConfigRules = {
     "requiredKeywords": ["name", "visible"],
-    "optionalKeywords": ["description", "safeRange", "shutdownRange", "sensorMixing"],
+    "optionalKeywords": ["description", "safeRange", "shutdownRange", "sensorMixing", "outlierThreshold"],
 }
 
 measurerConfigRules = {
     "requiredKeywords": ["name", "variable", "driverKey", "iterateMS", "active"],
-    "optionalKeywords": ["description", "offsetMS"],
+    "optionalKeywords": ["description", "offsetMS", "timeoutMS", "channel"],
 }
 
 effectorConfigRules = {
     "requiredKeywords": ["name", "driverKey", "controlType", "shutdownSetting", "active"],
     "optionalKeywords": ["description", "controlVariable", "controlBinaryThreshold", "controlLookupTable",
-                         "controlPIDConsts", "minChangeDelayMS"]
+                         "controlPIDConsts", "controlOutputRange", "minChangeDelayMS", "iterateMS", "offsetMS",
+                         "busDriverKey"]
 }
 
 processConfigRules = {
@@ -32,7 +35,7 @@ processConfigRules = {
 stageConfigRules = {
     "requiredKeywords": ["name", "stageEndControl"],
     "optionalKeywords": ["description", "overrides", "variableTargets", "effectorSettings",
-                         "recalculateTimers", "stageEndTimer", "stageEndTarget"]
+                         "recalculateTimers", "stageEndTimer", "stageEndTarget", "stageEndMode", "stageEndHoldMS"]
 }
 
 bannedOverrideKeys = ["name", "description"]
@@ -45,12 +48,16 @@ configTypeRules = {
     "description": "str",
     "visible": "bool",
     "iterateMS": "int",
+    "offsetMS": "int",
+    "timeoutMS": "int",
     "minChangeDelayMS": "int",
     "defaultTarget": "int",
     "safeRange": "list",
     "shutdownRange": "list",
     "sensorMixing": "str",
+    "outlierThreshold": "int",
     "driverKey": "str",
+    "busDriverKey": "str",
     "controlType": "str",
     "shutdownSetting": "int",
     "controlVariable": "str",
@@ -60,25 +67,29 @@ configTypeRules = {
     "active": "bool",
     "controlBinaryThreshold": "int",
     "controlPIDConsts": "list",
+    "controlOutputRange": "list",
     "controlLookupTable": "list",
     "stageEndTimer": "int",
-    "stageEndTarget": "dict"
+    "stageEndTarget": "dict",
+    "stageEndMode": "str",
+    "stageEndHoldMS": "int"
 }
 
 configEnumRules = {
-    "sensorMixing": ["min", "max", "avg"],
+    "sensorMixing": ["min", "max", "avg", "median", "rejectOutliers"],
     "controlType": ["static", "lookupMin", "lookupMax", "lookupClosest", "PID", "binary", "binaryInverted"],
-    "stageEndControl": ["target", "time", "shutdown"]
+    "stageEndControl": ["target", "time", "shutdown"],
+    "stageEndMode": ["all", "any"]
 }
 
 variableValueRequirements = {
     "controlType": {
-        "lookupMin": ["controlLookupTable", "controlVariable"],
-        "lookupMax": ["controlLookupTable", "controlVariable"],
-        "lookupClosest": ["controlLookupTable", "controlVariable"],
-        "PID": ["controlPIDConsts", "controlVariable"],
-        "binary": ["controlBinaryThreshold", "controlVariable"],
-        "binaryInverted": ["controlBinaryThreshold", "controlVariable"]
+        "lookupMin": ["controlLookupTable", "controlVariable", "iterateMS"],
+        "lookupMax": ["controlLookupTable", "controlVariable", "iterateMS"],
+        "lookupClosest": ["controlLookupTable", "controlVariable", "iterateMS"],
+        "PID": ["controlPIDConsts", "controlVariable", "iterateMS"],
+        "binary": ["controlBinaryThreshold", "controlVariable", "iterateMS"],
+        "binaryInverted": ["controlBinaryThreshold", "controlVariable", "iterateMS"]
     },
     "stageEndControl": {
         "target": ["stageEndTarget"],
@@ -86,16 +97,11 @@ variableValueRequirements = {
     }
 }
 
-variableNames = []
-measurerNames = []
-effectorNames = []
-
-
 class ValidationException(Exception):
     pass
 
 
-def testSafeRange(test):
+def testSafeRange(test, context):
     if type(test).__name__ != "list":
         return False
     if len(test) != 2:
@@ -107,16 +113,25 @@ def testSafeRange(test):
     return True
 
 
-def testPID(test):
+def testOutlierThreshold(test, context):
+    return type(test).__name__ == "int" and test > 0
+
+
+def testChannel(test, context):
+    return type(test).__name__ in ["str", "int"]
+
+
+def testPID(test, context):
     if type(test).__name__ != "list":
         return False
     if len(test) != 3:
         return False
     if type(test[0]).__name__ != "int" or type(test[1]).__name__ != "int" or type(test[2]).__name__ != "int":
         return False
+    return True
 
 
-def testLookupTable(test):
+def testLookupTable(test, context):
     if type(test).__name__ != "list":
         return False
     if len(test) == 0:
@@ -131,7 +146,7 @@ def testLookupTable(test):
     return True
 
 
-def testStages(test):
+def testStages(test, context):
     counter = 0
     keys = list(test.keys())
     while str(counter) in keys:
@@ -142,33 +157,33 @@ def testStages(test):
     return True
 
 
-def testVariableTargets(test):
+def testVariableTargets(test, context):
     if type(test).__name__ != "dict":
         return False
     for key, value in test.items():
-        if key not in variableNames:
+        if key not in context["variableNames"]:
             return False
         if type(value).__name__ != "int":
             return False
     return True
 
 
-def testEffectorSettings(test):
+def testEffectorSettings(test, context):
     if type(test).__name__ != "dict":
         return False
     for key, value in test.items():
-        if key not in effectorNames:
+        if key not in context["effectorNames"]:
             return False
         if type(value).__name__ != "int":
             return False
     return True
 
 
-def testStageEndTarget(test):
+def testStageEndTarget(test, context):
     if type(test).__name__ != "dict":
         return False
     for key, value in test.items():
-        if key not in variableNames:
+        if key not in context["variableNames"]:
             return False
         if type(value).__name__ != "list":
             return False
@@ -184,7 +199,10 @@ def testStageEndTarget(test):
 variableTestFunctions = {
     "safeRange": testSafeRange,
     "shutdownRange": testSafeRange,
+    "channel": testChannel,
+    "outlierThreshold": testOutlierThreshold,
     "controlPIDConsts": testPID,
+    "controlOutputRange": testSafeRange,
     "controlLookupTable": testLookupTable,
     "stages": testStages,
     "variableTargets": testVariableTargets,
@@ -195,7 +213,10 @@ variableTestFunctions = {
 variableTestFunctionFailMessages = {
     "safeRange": "Needs to be a list with two non equal integers",
     "shutdownRange": "Needs to be a list with two non equal integers",
+    "channel": "Needs to be a string or an integer",
+    "outlierThreshold": "Needs to be a positive integer",
     "controlPIDConsts": "Needs to be a list with three integers",
+    "controlOutputRange": "Needs to be a list with two non equal integers",
     "controlLookupTable": "Needs to be a list of tuples with each first tuple element being an integer.",
     "stages": "Stage keys must start from 0 and count up by one, with lower numbered stages going first.",
     "variableTargets": "Must be a dictionary where each key is a valid variable and each value is an integer",
@@ -205,7 +226,7 @@ variableTestFunctionFailMessages = {
 }
 
 
-def validateSection(sectionKey, sectionData, sectionRules, message):
+def validateSection(sectionKey, sectionData, sectionRules, message, context):
     requiredKeywords = copy.copy(sectionRules["requiredKeywords"])
     if "name" not in sectionData:
         raise ValidationException(message + sectionKey + " Lacks name variable")
@@ -228,7 +249,7 @@ def validateSection(sectionKey, sectionData, sectionRules, message):
             if keyValue in variableValueRequirements[keyword]:
                 requiredKeywords.extend(variableValueRequirements[keyword][keyValue])
         if keyword in variableTestFunctions:
-            if not variableTestFunctions[keyword](keyValue):
+            if not variableTestFunctions[keyword](keyValue, context):
                 if keyword in variableTestFunctionFailMessages:
                     raise ValidationException(message + "Validation function failed for " + keyword + " " +
                                               variableTestFunctionFailMessages[keyword])
@@ -241,33 +262,51 @@ def validateSection(sectionKey, sectionData, sectionRules, message):
     return True
 
 
-def validateMachineConfig(machineConfig, deviceDrivers, message):
-    validateSection(False, machineConfig, machineConfigRules, message)
-    for variableKey, variableData in machineConfig["variables"].items():
-        validateSection(variableKey, variableData, variableConfigRules, message + "Variable: ")
-    for measurerKey, measurerData in machineConfig["measurers"].items():
-        validateSection(measurerKey, measurerData, measurerConfigRules, message + "Measurer: ")
-    for effectorKey, effectorData in machineConfig["effectors"].items():
-        validateSection(effectorKey, effectorData, effectorConfigRules, message + "Effector: ")
-    effectorVariables = [x["controlVariable"] for x in machineConfig["effectors"].values() if "controlVariable" in x]
-    for x in effectorVariables:
-        if x not in machineConfig["variables"]:
-            raise ValidationException(message + "Effector variable " + str(x) + " is not present.")
-    measurerVariables = [x["variable"] for x in machineConfig["measurers"].values()]
-    for x in measurerVariables:
-        if x not in machineConfig["variables"]:
-            raise ValidationException(message + "Measurer variable " + str(x) + " is not present.")
-    driverKeys = [x["driverKey"] for x in machineConfig["measurers"].values()] + \
-                 [x["driverKey"] for x in machineConfig["effectors"].values()]
-    for x in driverKeys:
-        if x not in deviceDrivers:
-            raise ValidationException(message + "Driver " + str(x) + " is not present.")
-
-
-def validateProcessConfig(processConfig, message):
-    validateSection(False, processConfig, processConfigRules, message)
+sectionConfigRules = {
+    "variables": variableConfigRules,
+    "measurers": measurerConfigRules,
+    "effectors": effectorConfigRules
+}
+
+sectionMessages = {
+    "variables": "Variable: ",
+    "measurers": "Measurer: ",
+    "effectors": "Effector: "
+}
+
+
+def validateSectionReferences(sectionType, sectionData, machineConfig, deviceDrivers, message):
+    if sectionType == "effectors" and "controlVariable" in sectionData:
+        if sectionData["controlVariable"] not in machineConfig["variables"]:
+            raise ValidationException(message + "Effector variable " + str(sectionData["controlVariable"]) +
+                                      " is not present.")
+    if sectionType == "measurers":
+        if sectionData["variable"] not in machineConfig["variables"]:
+            raise ValidationException(message + "Measurer variable " + str(sectionData["variable"]) +
+                                      " is not present.")
+    if sectionType in ["measurers", "effectors"]:
+        if sectionData["driverKey"] not in deviceDrivers:
+            raise ValidationException(message + "Driver " + str(sectionData["driverKey"]) + " is not present.")
+    if sectionType == "effectors" and "busDriverKey" in sectionData:
+        if sectionData["busDriverKey"] not in deviceDrivers:
+            raise ValidationException(message + "Bus driver " + str(sectionData["busDriverKey"]) + " is not present.")
+
+
+def validateMachineConfig(machineConfig, deviceDrivers, message, context):
+    validateSection(False, machineConfig, machineConfigRules, message, context)
+    for sectionType in ["variables", "measurers", "effectors"]:
+        for sectionKey, sectionData in machineConfig[sectionType].items():
+            validateSection(sectionKey, sectionData, sectionConfigRules[sectionType],
+                            message + sectionMessages[sectionType], context)
+    for sectionType in ["measurers", "effectors"]:
+        for sectionData in machineConfig[sectionType].values():
+            validateSectionReferences(sectionType, sectionData, machineConfig, deviceDrivers, message)
+
+
+def validateProcessConfig(processConfig, message, context):
+    validateSection(False, processConfig, processConfigRules, message, context)
     for stage in processConfig["stages"].values():
-        validateSection(False, stage, stageConfigRules, message)
+        validateSection(False, stage, stageConfigRules, message, context)
 
 
 def testName(segment, message):
@@ -278,9 +317,7 @@ def testName(segment, message):
 
 
 def validateNamespace(machineConfig, processConfig):
-    global variableNames
-    global measurerNames
-    global effectorNames
+    context = {"variableNames": set(), "measurerNames": set(), "effectorNames": set()}
     testName(machineConfig, "Machine config: ")
     machineNamespace = [machineConfig["name"]]
     for variable in machineConfig["variables"].values():
@@ -288,19 +325,19 @@ def validateNamespace(machineConfig, processConfig):
         if variable["name"] in machineNamespace:
             raise ValidationException("Namespace collision: Variable name " + variable["name"] + " already used.")
         machineNamespace.append(variable["name"])
-        variableNames.append(variable["name"])
+        context["variableNames"].add(variable["name"])
     for measurer in machineConfig["measurers"].values():
         testName(measurer, "Measurer: ")
         if measurer["name"] in machineNamespace:
             raise ValidationException("Namespace collision: Measurer name " + measurer["name"] + " already used.")
         machineNamespace.append(measurer["name"])
-        measurerNames.append(measurer["name"])
+        context["measurerNames"].add(measurer["name"])
     for effector in machineConfig["effectors"].values():
         testName(effector, "Effector: ")
         if effector["name"] in machineNamespace:
             raise ValidationException("Namespace collision: Effector name " + effector["name"] + " already used.")
         machineNamespace.append(effector["name"])
-        effectorNames.append(effector["name"])
+        context["effectorNames"].add(effector["name"])
     testName(processConfig, "Process Config: ")
     processNamespace = [processConfig["name"]]
     for stage in processConfig["stages"].values():
@@ -315,41 +352,103 @@ def validateNamespace(machineConfig, processConfig):
     if processConfig["forMachine"] != machineConfig["name"]:
         raise ValidationException("Process config forMachine '" + processConfig["forMachine"] + "' and machine name '" +
                                   machineConfig["name"] + "' do not match.")
+    return context
 
 
-def applyOverrides(config, overrides, message):
+def overlayOverrides(sectionData, overrides, message):
+    mergedSection = dict(sectionData)
     for key, value in overrides.items():
         if key in bannedOverrideKeys:
             raise ValidationException(message + "Invalid override keyword: " + key)
-        if key in config:
-            if type(value).__name__ == "dict":
-                applyOverrides(config[key], value, message)
+        if key in mergedSection:
+            if type(value).__name__ == "dict" and type(mergedSection[key]).__name__ == "dict":
+                mergedSection[key] = overlayOverrides(mergedSection[key], value, message)
             else:
-                config[key] = value
-    return True, ""
+                mergedSection[key] = value
+    return mergedSection
+
+
+def validateOverrides(machineConfig, overrides, deviceDrivers, message, context):
+    for key, value in overrides.items():
+        if key in bannedOverrideKeys:
+            raise ValidationException(message + "Invalid override keyword: " + key)
+        if key not in machineConfig:
+            continue
+        if key not in sectionConfigRules or type(value).__name__ != "dict":
+            stageMachineConfig = overlayOverrides(machineConfig, overrides, message)
+            validateMachineConfig(stageMachineConfig, deviceDrivers, message, context)
+            return
+    for sectionType, sectionOverrides in overrides.items():
+        if sectionType not in sectionConfigRules:
+            continue
+        for sectionKey, itemOverrides in sectionOverrides.items():
+            if sectionKey not in machineConfig[sectionType]:
+                continue
+            if type(itemOverrides).__name__ == "dict":
+                sectionData = overlayOverrides(machineConfig[sectionType][sectionKey], itemOverrides, message)
+            else:
+                sectionData = itemOverrides
+            validateSection(sectionKey, sectionData, sectionConfigRules[sectionType],
+                            message + sectionMessages[sectionType], context)
+            validateSectionReferences(sectionType, sectionData, machineConfig, deviceDrivers, message)
+
+
+def configHash(machineConfig, processConfig, deviceDrivers):
+    content = json.dumps([machineConfig, processConfig, sorted(deviceDrivers)], sort_keys=True, default=repr)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class ValidationCache:
+    def __init__(self, maxSize=128):
+        self.maxSize = maxSize
+        self.results = collections.OrderedDict()
+
+    def get(self, key):
+        if key not in self.results:
+            return None
+        self.results.move_to_end(key)
+        return self.results[key]
+
+    def put(self, key, result):
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.maxSize:
+            self.results.popitem(last=False)
+
+    def clear(self):
+        self.results.clear()
+
+
+validationCache = ValidationCache()
 
 
-def validateFullConfig(machineConfig, processConfig, deviceDrivers):
-    testedBaseMachineConfig = False
+def validateFullConfig(machineConfig, processConfig, deviceDrivers, cache=validationCache):
+    cacheKey = None
+    if cache is not None:
+        cacheKey = configHash(machineConfig, processConfig, deviceDrivers)
+        cachedResult = cache.get(cacheKey)
+        if cachedResult is not None:
+            return cachedResult
+    result = True, ""
     try:
-        validateNamespace(machineConfig, processConfig)
-        validateProcessConfig(processConfig, "Process Config: ")
+        context = validateNamespace(machineConfig, processConfig)
+        validateProcessConfig(processConfig, "Process Config: ", context)
+        validateMachineConfig(machineConfig, deviceDrivers, "Machine Config: ", context)
+        if "overrides" in processConfig:
+            validateOverrides(machineConfig, processConfig["overrides"], deviceDrivers, "Process override: ", context)
+            machineConfig = overlayOverrides(machineConfig, processConfig["overrides"], "Process override: ")
         for stage in processConfig["stages"].values():
             if "overrides" in stage:
-                if stage["overrides"]:
-                    stageMachineConfig = copy.deepcopy(machineConfig)
-                    applyOverrides(stageMachineConfig, stage["overrides"], stage["name"] + "override failure: ")
-                    validateMachineConfig(stageMachineConfig, deviceDrivers, stage["name"] + "override: ")
-                    continue
-            if not testedBaseMachineConfig:
-                validateMachineConfig(machineConfig, deviceDrivers, stage["name"] + "no overrides: ")
-                testedBaseMachineConfig = True
+                validateOverrides(machineConfig, stage["overrides"], deviceDrivers, stage["name"] + " override: ",
+                                  context)
     except ValidationException as e:
-        return False, str(e)
-    return True, ""
+        result = False, str(e)
+    if cache is not None:
+        cache.put(cacheKey, result)
+    return result
 
 
 if __name__ == "__main__":
     fakeMachineConfig = json.loads(open("fakeMachineConfig.json").read())
     fakeProcessConfig = json.loads(open("fakeProcessConfig.json").read())
-    print(validateFullConfig(fakeMachineConfig, fakeProcessConfig, fakeDeviceDrivers))
+    print(validateFullConfig(fakeMachineConfig, fakeProcessConfig, loadDriverRegistry("fakeDrivers.json")))
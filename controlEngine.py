@@ -0,0 +1,211 @@
+import os
+import threading
+import multiprocessing
+import collections
+import queue
+import time
+
+from machineEngine import runMachineProcess
+
+
+class SupervisorException(Exception):
+    pass
+
+
+class TaggedQueue:
+    def __init__(self, machineName, messageQueue):
+        self.machineName = machineName
+        self.messageQueue = messageQueue
+
+    def put(self, message):
+        self.messageQueue.put((self.machineName, message))
+
+
+def runMachineWorker(machineName, machineConfig, processConfig, deviceDrivers, messageQueue, stopEvent, core,
+                     workerOptions):
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {core})
+    taggedQueue = TaggedQueue(machineName, messageQueue)
+    try:
+        runMachineProcess(machineConfig, processConfig, deviceDrivers, taggedQueue, stopEvent=stopEvent,
+                          **workerOptions)
+    except Exception as e:
+        taggedQueue.put(["SHUTDOWN", "WORKER ERROR", repr(e)])
+    taggedQueue.put("EXIT")
+
+
+class MachineWorker:
+    def __init__(self, name, machineConfig, processConfig, deviceDrivers, workerOptions):
+        self.name = name
+        self.machineConfig = machineConfig
+        self.processConfig = processConfig
+        self.deviceDrivers = deviceDrivers
+        self.workerOptions = workerOptions
+        self.process = None
+        self.messageQueue = None
+        self.stopEvent = None
+        self.core = None
+        self.stage = None
+        self.tickLag = None
+        self.maxTickLag = 0
+        self.shutdownReason = None
+        self.messages = collections.deque(maxlen=1000)
+
+    def isAlive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class MachineSupervisor:
+    def __init__(self, cores=None, context=None):
+        if cores is None:
+            if hasattr(os, "sched_getaffinity"):
+                cores = sorted(os.sched_getaffinity(0))
+            else:
+                cores = list(range(os.cpu_count() or 1))
+        self.cores = cores
+        self.context = context or multiprocessing.get_context()
+        self.machines = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.queueLock = threading.Lock()
+        self.readerThread = None
+        self.running = False
+
+    def addMachine(self, name, machineConfig, processConfig, deviceDrivers, **workerOptions):
+        if name in self.machines:
+            raise SupervisorException("Machine " + name + " already added")
+        self.machines[name] = MachineWorker(name, machineConfig, processConfig, deviceDrivers, workerOptions)
+
+    def removeMachine(self, name):
+        self.stopMachine(name)
+        del self.machines[name]
+
+    def addListener(self, listener):
+        self.listeners.append(listener)
+
+    def assignCore(self):
+        load = {x: 0 for x in self.cores}
+        for machine in self.machines.values():
+            if machine.isAlive() and machine.core in load:
+                load[machine.core] += 1
+        return min(self.cores, key=lambda x: load[x])
+
+    def startMachine(self, name):
+        machine = self.machines[name]
+        if machine.isAlive():
+            raise SupervisorException("Machine " + name + " already running")
+        self.startReader()
+        self.drainQueue(machine)
+        machine.messageQueue = self.context.Queue()
+        machine.core = self.assignCore()
+        machine.stopEvent = self.context.Event()
+        machine.stage = None
+        machine.tickLag = None
+        machine.maxTickLag = 0
+        machine.shutdownReason = None
+        machine.process = self.context.Process(target=runMachineWorker, name="machine-" + name, daemon=True,
+                                               args=(name, machine.machineConfig, machine.processConfig,
+                                                     machine.deviceDrivers, machine.messageQueue, machine.stopEvent,
+                                                     machine.core, machine.workerOptions))
+        machine.process.start()
+
+    def stopMachine(self, name, timeout=5):
+        machine = self.machines[name]
+        if machine.process is None:
+            return
+        machine.stopEvent.set()
+        machine.process.join(timeout)
+        if machine.process.is_alive():
+            with self.queueLock:
+                messageQueue = machine.messageQueue
+                machine.messageQueue = None
+            machine.process.terminate()
+            machine.process.join()
+            messageQueue.close()
+            messageQueue.cancel_join_thread()
+            self.handleMessage(name, ["SHUTDOWN", "WORKER ERROR", "Worker terminated after stop timeout"])
+
+    def restartMachine(self, name, timeout=5):
+        self.stopMachine(name, timeout)
+        self.startMachine(name)
+
+    def startAll(self):
+        for name in self.machines:
+            self.startMachine(name)
+
+    def stopAll(self, timeout=5):
+        for machine in self.machines.values():
+            if machine.stopEvent is not None:
+                machine.stopEvent.set()
+        for name in self.machines:
+            self.stopMachine(name, timeout)
+
+    def startReader(self):
+        if self.readerThread is not None and self.readerThread.is_alive():
+            return
+        self.running = True
+        self.readerThread = threading.Thread(target=self.readMessages, name="supervisorReader", daemon=True)
+        self.readerThread.start()
+
+    def shutdown(self, timeout=5):
+        self.stopAll(timeout)
+        self.running = False
+        if self.readerThread is not None:
+            self.readerThread.join()
+        for machine in list(self.machines.values()):
+            self.drainQueue(machine)
+
+    def drainQueue(self, machine):
+        received = False
+        with self.queueLock:
+            if machine.messageQueue is None:
+                return False
+            messages = []
+            while True:
+                try:
+                    messages.append(machine.messageQueue.get_nowait())
+                except queue.Empty:
+                    break
+        for machineName, message in messages:
+            received = True
+            self.handleMessage(machineName, message)
+        return received
+
+    def readMessages(self):
+        while self.running:
+            received = False
+            for machine in list(self.machines.values()):
+                received = self.drainQueue(machine) or received
+            if not received:
+                time.sleep(0.01)
+
+    def handleMessage(self, machineName, message):
+        machine = self.machines.get(machineName)
+        if machine is None:
+            return
+        with self.lock:
+            machine.messages.append(message)
+            if type(message).__name__ == "list":
+                if message[0] == "STAGE INIT":
+                    machine.stage = message[1]
+                elif message[0] == "TICK LAG":
+                    machine.tickLag = message[1]
+                    machine.maxTickLag = max(machine.maxTickLag, message[1])
+                elif message[0] == "SHUTDOWN":
+                    machine.shutdownReason = message[1:]
+        for listener in self.listeners:
+            listener(machineName, message)
+
+    def status(self):
+        with self.lock:
+            return {x.name: {"alive": x.isAlive(), "core": x.core, "stage": x.stage, "tickLag": x.tickLag,
+                             "maxTickLag": x.maxTickLag, "shutdownReason": x.shutdownReason}
+                    for x in self.machines.values()}
+
+    def tickLag(self):
+        with self.lock:
+            return {x.name: x.tickLag for x in self.machines.values()}
+
+    def saturatedMachines(self, lagThresholdMS=50):
+        with self.lock:
+            return [x.name for x in self.machines.values() if x.tickLag is not None and x.tickLag > lagThresholdMS]
@@ -0,0 +1,121 @@
+import asyncio
+import concurrent.futures
+import inspect
+import threading
+import time
+
+
+def groupMeasurers(measurers):
+    singles = []
+    groups = {}
+    for position, measurer in enumerate(measurers):
+        if measurer.bulkDriver is None:
+            singles.append(position)
+        else:
+            groups.setdefault(measurer.bulkDriver, []).append(position)
+    return singles, groups
+
+
+def readMeasurers(measurers):
+    values = [None] * len(measurers)
+    singles, groups = groupMeasurers(measurers)
+    for position in singles:
+        values[position] = measurers[position].driver()
+    for bulkDriver, positions in groups.items():
+        channels = [measurers[x].channel for x in positions]
+        if inspect.iscoroutinefunction(bulkDriver):
+            results = asyncio.run(bulkDriver(channels))
+        else:
+            results = bulkDriver(channels)
+        for position, value in zip(positions, results):
+            values[position] = value
+    return values
+
+
+class DriverExecutor:
+    def __init__(self, maxWorkers=8, defaultTimeoutMS=1000):
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="driver")
+        self.defaultTimeoutMS = defaultTimeoutMS
+        self.loop = None
+        self.loopThread = None
+        self.pending = {}
+        self.timeouts = {}
+
+    def getLoop(self):
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.loopThread = threading.Thread(target=self.loop.run_forever, name="driverLoop", daemon=True)
+            self.loopThread.start()
+        return self.loop
+
+    def submit(self, pendingKey, driver, *args):
+        pendingFuture = self.pending.get(pendingKey)
+        if pendingFuture is not None and not pendingFuture.done():
+            return None
+        if inspect.iscoroutinefunction(driver):
+            future = asyncio.run_coroutine_threadsafe(driver(*args), self.getLoop())
+        else:
+            future = self.pool.submit(driver, *args)
+        self.pending[pendingKey] = future
+        return future
+
+    def submitMeasurer(self, measurer):
+        if measurer.asyncDriver is not None:
+            return self.submit(measurer.index, measurer.asyncDriver)
+        return self.submit(measurer.index, measurer.driver)
+
+    def waitFor(self, future, dispatchTime, timeoutMS):
+        if future is None:
+            return False, None
+        remaining = dispatchTime + timeoutMS / 1000 - time.perf_counter()
+        try:
+            return True, future.result(timeout=max(remaining, 0))
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return False, None
+
+    def measurerTimeout(self, measurer):
+        if measurer.timeoutMS is None:
+            return self.defaultTimeoutMS
+        return measurer.timeoutMS
+
+    def readMeasurers(self, measurers):
+        dispatchTime = time.perf_counter()
+        singles, groups = groupMeasurers(measurers)
+        singleFutures = [self.submitMeasurer(measurers[x]) for x in singles]
+        groupFutures = [self.submit(x, x, [measurers[y].channel for y in positions])
+                        for x, positions in groups.items()]
+        values = [None] * len(measurers)
+        for position, future in zip(singles, singleFutures):
+            measurer = measurers[position]
+            completed, values[position] = self.waitFor(future, dispatchTime, self.measurerTimeout(measurer))
+            if not completed:
+                self.timeouts[measurer.name] = self.timeouts.get(measurer.name, 0) + 1
+        for positions, future in zip(groups.values(), groupFutures):
+            timeoutMS = max(self.measurerTimeout(measurers[x]) for x in positions)
+            completed, results = self.waitFor(future, dispatchTime, timeoutMS)
+            for position, value in zip(positions, results if completed else []):
+                values[position] = value
+            if not completed:
+                for position in positions:
+                    measurer = measurers[position]
+                    self.timeouts[measurer.name] = self.timeouts.get(measurer.name, 0) + 1
+        return values
+
+    async def cancelTasks(self):
+        tasks = [x for x in asyncio.all_tasks() if x is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        if self.loop is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self.cancelTasks(), self.loop).result(self.defaultTimeoutMS / 1000)
+            except concurrent.futures.TimeoutError:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loopThread.join()
+            self.loop.close()
+            self.loop = None
@@ -0,0 +1,95 @@
+import collections.abc
+import importlib
+import importlib.metadata
+import json
+
+driverEntryPointGroup = "yliaster.drivers"
+
+
+class DriverRegistryException(Exception):
+    pass
+
+
+def loadDriverPath(path):
+    moduleName, separator, attributePath = path.partition(":")
+    if not separator or not moduleName or not attributePath:
+        raise DriverRegistryException("Driver path " + path + " must be of the form module:attribute")
+    try:
+        driver = importlib.import_module(moduleName)
+    except ImportError as e:
+        raise DriverRegistryException("Could not import driver module " + moduleName + ": " + str(e))
+    for attributeName in attributePath.split("."):
+        if not hasattr(driver, attributeName):
+            raise DriverRegistryException("Driver " + path + " not found")
+        driver = getattr(driver, attributeName)
+    return driver
+
+
+class DriverRegistry(collections.abc.Mapping):
+    def __init__(self, drivers=None, entryPointGroup=driverEntryPointGroup, wrapper=None):
+        self.drivers = dict(drivers or {})
+        self.entryPointGroup = entryPointGroup
+        self.wrapper = wrapper
+        self.entryPoints = None
+        self.loaded = {}
+
+    def register(self, driverKey, driver):
+        self.drivers[driverKey] = driver
+        self.loaded.pop(driverKey, None)
+
+    def availableEntryPoints(self):
+        if self.entryPoints is None:
+            self.entryPoints = {}
+            if self.entryPointGroup is not None:
+                for entryPoint in importlib.metadata.entry_points(group=self.entryPointGroup):
+                    self.entryPoints[entryPoint.name] = entryPoint
+        return self.entryPoints
+
+    def resolve(self, driverKey):
+        if driverKey in self.loaded:
+            return self.loaded[driverKey]
+        if driverKey in self.drivers:
+            driver = self.drivers[driverKey]
+            if type(driver).__name__ == "str":
+                driver = loadDriverPath(driver)
+        elif driverKey in self.availableEntryPoints():
+            try:
+                driver = self.entryPoints[driverKey].load()
+            except ImportError as e:
+                raise DriverRegistryException("Could not load driver entry point " + driverKey + ": " + str(e))
+        else:
+            raise KeyError(driverKey)
+        if not callable(driver):
+            raise DriverRegistryException("Driver " + driverKey + " is not callable")
+        if self.wrapper is not None:
+            driver = self.wrapper(driverKey, driver)
+        self.loaded[driverKey] = driver
+        return driver
+
+    def wrapped(self, wrapper):
+        return DriverRegistry(self.drivers, self.entryPointGroup, wrapper)
+
+    def isLoaded(self, driverKey):
+        return driverKey in self.loaded
+
+    def __getitem__(self, driverKey):
+        return self.resolve(driverKey)
+
+    def __contains__(self, driverKey):
+        return driverKey in self.drivers or driverKey in self.availableEntryPoints()
+
+    def __iter__(self):
+        return iter(list(self.drivers) + [x for x in self.availableEntryPoints() if x not in self.drivers])
+
+    def __len__(self):
+        return len(self.drivers) + len([x for x in self.availableEntryPoints() if x not in self.drivers])
+
+    def __getstate__(self):
+        return {"drivers": self.drivers, "entryPointGroup": self.entryPointGroup, "wrapper": self.wrapper}
+
+    def __setstate__(self, state):
+        self.__init__(state["drivers"], state["entryPointGroup"], state["wrapper"])
+
+
+def loadDriverRegistry(path, entryPointGroup=driverEntryPointGroup):
+    return DriverRegistry(json.loads(open(path).read()), entryPointGroup)
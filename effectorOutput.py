@@ -0,0 +1,64 @@
+class EffectorOutput:
+    def __init__(self, effectorCount, eventStream=None):
+        self.eventStream = eventStream
+        self.values = [None] * effectorCount
+        self.writeTimes = [None] * effectorCount
+        self.pending = [None] * effectorCount
+        self.busWrites = {}
+        self.written = 0
+        self.skipped = 0
+        self.held = 0
+
+    def write(self, effector, value, currentTime, scheduler=None):
+        index = effector.index
+        if value == self.values[index]:
+            self.pending[index] = None
+            self.skipped += 1
+            return False
+        lastWriteTime = self.writeTimes[index]
+        if effector.minChangeDelayMS and lastWriteTime is not None and \
+                currentTime < lastWriteTime + effector.minChangeDelayMS:
+            if self.pending[index] is None and scheduler is not None:
+                scheduler.schedule(lastWriteTime + effector.minChangeDelayMS, ("release", index))
+            self.pending[index] = (value,)
+            self.held += 1
+            return False
+        self.send(effector, value, currentTime)
+        return True
+
+    def force(self, effector, value, currentTime):
+        self.send(effector, value, currentTime)
+
+    def release(self, effector, currentTime, scheduler=None):
+        pending = self.pending[effector.index]
+        if pending is None:
+            return False
+        self.pending[effector.index] = None
+        return self.write(effector, pending[0], currentTime, scheduler)
+
+    def clearPending(self):
+        self.pending = [None] * len(self.pending)
+
+    def send(self, effector, value, currentTime):
+        if effector.busDriver is None:
+            effector.driver(value)
+        else:
+            busWrites = self.busWrites.setdefault(effector.busDriverKey, (effector.busDriver, []))
+            busWrites[1].append((effector.driverKey, value))
+        self.pending[effector.index] = None
+        self.values[effector.index] = value
+        self.writeTimes[effector.index] = currentTime
+        self.written += 1
+        if self.eventStream is not None:
+            self.eventStream.effector(effector.index, currentTime, value)
+
+    def flush(self):
+        if not self.busWrites:
+            return
+        busWrites = self.busWrites
+        self.busWrites = {}
+        for busDriver, writes in busWrites.values():
+            busDriver(writes)
+
+    def stats(self):
+        return {"written": self.written, "skipped": self.skipped, "held": self.held}
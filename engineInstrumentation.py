@@ -0,0 +1,102 @@
+import array
+import inspect
+import threading
+import time
+
+from driverRegistry import DriverRegistry
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "total", "maximum", "lock")
+
+    def __init__(self, buckets=32):
+        self.counts = array.array("q", bytes(8 * buckets))
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+        self.lock = threading.Lock()
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        bucket = value.bit_length()
+        if bucket >= len(self.counts):
+            bucket = len(self.counts) - 1
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += value
+            if value > self.maximum:
+                self.maximum = value
+
+    def reset(self):
+        with self.lock:
+            for bucket in range(len(self.counts)):
+                self.counts[bucket] = 0
+            self.count = 0
+            self.total = 0
+            self.maximum = 0
+
+    def summary(self):
+        with self.lock:
+            lastBucket = len(self.counts)
+            while lastBucket > 0 and self.counts[lastBucket - 1] == 0:
+                lastBucket -= 1
+            return {"count": self.count, "mean": self.total / self.count if self.count else None,
+                    "max": self.maximum, "histogram": self.counts[:lastBucket].tolist()}
+
+
+class EngineInstrumentation:
+    def __init__(self, reportMS=5000):
+        self.reportMS = reportMS
+        self.nextReportTime = None
+        self.tickTimeUS = LatencyHistogram()
+        self.tickLagMS = LatencyHistogram()
+        self.driverLatencyUS = {}
+
+    def instrumentDrivers(self, deviceDrivers):
+        if isinstance(deviceDrivers, DriverRegistry):
+            return deviceDrivers.wrapped(self.instrumentDriver)
+        return {x: self.instrumentDriver(x, y) for x, y in deviceDrivers.items()}
+
+    def instrumentDriver(self, driverKey, driver):
+        histogram = self.driverLatencyUS.setdefault(driverKey, LatencyHistogram())
+        if inspect.iscoroutinefunction(driver):
+            async def timedDriver(*args):
+                callStart = time.perf_counter_ns()
+                try:
+                    return await driver(*args)
+                finally:
+                    histogram.record((time.perf_counter_ns() - callStart) // 1000)
+        else:
+            def timedDriver(*args):
+                callStart = time.perf_counter_ns()
+                try:
+                    return driver(*args)
+                finally:
+                    histogram.record((time.perf_counter_ns() - callStart) // 1000)
+        if hasattr(driver, "readChannels"):
+            timedDriver.readChannels = self.instrumentDriver(driverKey + ".bulk", driver.readChannels)
+        return timedDriver
+
+    def recordTick(self, tickStartNS, tickLagMS):
+        self.tickTimeUS.record((time.perf_counter_ns() - tickStartNS) // 1000)
+        self.tickLagMS.record(tickLagMS)
+
+    def reportDue(self, currentTime):
+        if self.nextReportTime is None:
+            self.nextReportTime = currentTime + self.reportMS
+        return currentTime >= self.nextReportTime
+
+    def summary(self):
+        return {"tickTimeUS": self.tickTimeUS.summary(), "tickLagMS": self.tickLagMS.summary(),
+                "driverLatencyUS": {x: y.summary() for x, y in self.driverLatencyUS.items()}}
+
+    def report(self, currentTime):
+        summary = self.summary()
+        self.tickTimeUS.reset()
+        self.tickLagMS.reset()
+        for histogram in self.driverLatencyUS.values():
+            histogram.reset()
+        self.nextReportTime = currentTime + self.reportMS
+        return summary
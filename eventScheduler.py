@@ -0,0 +1,92 @@
+import heapq
+import itertools
+
+
+class EventScheduler:
+    def __init__(self):
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.cancelledCount = 0
+
+    def __len__(self):
+        return len(self.heap) - self.cancelledCount
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def schedule(self, eventTime, event):
+        entry = [eventTime, next(self.counter), event, True]
+        heapq.heappush(self.heap, entry)
+        if event not in self.entries:
+            self.entries[event] = []
+        self.entries[event].append(entry)
+        return entry
+
+    def cancel(self, event):
+        if event not in self.entries:
+            return 0
+        cancelled = 0
+        for entry in self.entries.pop(event):
+            entry[3] = False
+            cancelled += 1
+        self.cancelledCount += cancelled
+        if self.cancelledCount > len(self.heap) // 2:
+            self.compact()
+        return cancelled
+
+    def cancelEntry(self, entry):
+        if not entry[3]:
+            return False
+        entry[3] = False
+        self.cancelledCount += 1
+        self.forgetEntry(entry)
+        return True
+
+    def forgetEntry(self, entry):
+        eventEntries = self.entries[entry[2]]
+        eventEntries.remove(entry)
+        if not eventEntries:
+            del self.entries[entry[2]]
+
+    def compact(self):
+        self.heap = [x for x in self.heap if x[3]]
+        heapq.heapify(self.heap)
+        self.cancelledCount = 0
+
+    def discardCancelled(self):
+        while self.heap and not self.heap[0][3]:
+            heapq.heappop(self.heap)
+            self.cancelledCount -= 1
+
+    def peekTime(self):
+        self.discardCancelled()
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def popNext(self):
+        nextTime = self.peekTime()
+        if nextTime is None:
+            raise IndexError("pop from empty scheduler")
+        dueEvents = []
+        while self.heap and self.heap[0][0] == nextTime:
+            entry = heapq.heappop(self.heap)
+            if not entry[3]:
+                self.cancelledCount -= 1
+                continue
+            entry[3] = False
+            self.forgetEntry(entry)
+            dueEvents.append(entry[2])
+        return nextTime, dueEvents
+
+    def events(self):
+        return [(x[0], x[2]) for x in sorted(self.heap) if x[3]]
+
+    def activeEvents(self):
+        return [(x[0], x[2]) for x in self.heap if x[3]]
+
+    def clear(self):
+        self.heap = []
+        self.entries = {}
+        self.cancelledCount = 0
@@ -0,0 +1,137 @@
+import json
+import math
+import struct
+
+streamVersion = 1
+frameMagic = b"YLES"
+frameHeader = struct.Struct("<4sBBI")
+eventRecord = struct.Struct("<BHqd")
+
+FRAME_CHANNELS = 1
+FRAME_EVENTS = 2
+
+EVENT_STAGE = 1
+EVENT_MEASUREMENT = 2
+EVENT_VARIABLE = 3
+EVENT_EFFECTOR = 4
+EVENT_SHUTDOWN = 5
+
+eventNames = {
+    EVENT_STAGE: "stage",
+    EVENT_MEASUREMENT: "measurement",
+    EVENT_VARIABLE: "variable",
+    EVENT_EFFECTOR: "effector",
+    EVENT_SHUTDOWN: "shutdown"
+}
+
+shutdownReasons = ["PROCESS COMPLETE", "STOPPED", "PROCESS ERROR", "VALIDATION ERROR", "WORKER ERROR",
+                   "SAFETY SHUTDOWN"]
+
+
+class EventStreamException(Exception):
+    pass
+
+
+class EventStreamWriter:
+    def __init__(self, sink, flushMS=0, capacity=4096):
+        self.sink = sink
+        self.flushMS = flushMS
+        self.capacity = capacity
+        self.buffer = bytearray(frameHeader.size + eventRecord.size * capacity)
+        self.count = 0
+        self.nextFlushTime = None
+
+    def writeChannels(self, processData):
+        channels = {"version": streamVersion, "variables": processData["variableNames"],
+                    "measurers": processData["measurerNames"], "effectors": processData["effectorNames"]}
+        payload = json.dumps(channels).encode()
+        self.sink(frameHeader.pack(frameMagic, streamVersion, FRAME_CHANNELS, len(payload)) + payload)
+
+    def record(self, eventType, channel, eventTime, value):
+        if self.count == self.capacity:
+            self.flush()
+        eventRecord.pack_into(self.buffer, frameHeader.size + self.count * eventRecord.size, eventType, channel,
+                              eventTime, value)
+        self.count += 1
+
+    def stage(self, stageIndex, eventTime):
+        self.record(EVENT_STAGE, stageIndex, eventTime, math.nan)
+
+    def measurement(self, measurerIndex, eventTime, value):
+        self.record(EVENT_MEASUREMENT, measurerIndex, eventTime, math.nan if value is None else value)
+
+    def variable(self, variableIndex, eventTime, value):
+        self.record(EVENT_VARIABLE, variableIndex, eventTime, value)
+
+    def effector(self, effectorIndex, eventTime, value):
+        self.record(EVENT_EFFECTOR, effectorIndex, eventTime, value)
+
+    def shutdown(self, reason, eventTime):
+        self.record(EVENT_SHUTDOWN, shutdownReasons.index(reason), eventTime, math.nan)
+        self.flush()
+
+    def endTick(self, currentTime):
+        if self.nextFlushTime is None:
+            self.nextFlushTime = currentTime + self.flushMS
+        if currentTime >= self.nextFlushTime:
+            self.flush()
+            self.nextFlushTime = currentTime + self.flushMS
+
+    def flush(self):
+        if self.count == 0:
+            return
+        frameHeader.pack_into(self.buffer, 0, frameMagic, streamVersion, FRAME_EVENTS, self.count)
+        self.sink(bytes(self.buffer[:frameHeader.size + self.count * eventRecord.size]))
+        self.count = 0
+
+
+def combineSinks(*sinks):
+    sinks = [x for x in sinks if x is not None]
+    if len(sinks) == 1:
+        return sinks[0]
+
+    def sink(frame):
+        for x in sinks:
+            x(frame)
+    return sink
+
+
+def decodeFrame(frame):
+    magic, version, frameType, length = frameHeader.unpack_from(frame, 0)
+    if magic != frameMagic:
+        raise EventStreamException("Invalid frame magic")
+    if version > streamVersion:
+        raise EventStreamException("Unsupported stream version " + str(version))
+    if frameType == FRAME_CHANNELS:
+        return frameType, json.loads(bytes(frame[frameHeader.size:frameHeader.size + length]))
+    if frameType == FRAME_EVENTS:
+        return frameType, list(eventRecord.iter_unpack(frame[frameHeader.size:frameHeader.size +
+                                                             length * eventRecord.size]))
+    raise EventStreamException("Unknown frame type " + str(frameType))
+
+
+class EventStreamReader:
+    def __init__(self):
+        self.channels = None
+
+    def read(self, frame):
+        frameType, content = decodeFrame(frame)
+        if frameType == FRAME_CHANNELS:
+            self.channels = content
+            return []
+        return [self.describe(x) for x in content]
+
+    def describe(self, event):
+        eventType, channel, eventTime, value = event
+        channelName = channel
+        if eventType == EVENT_MEASUREMENT and self.channels is not None:
+            channelName = self.channels["measurers"][channel]
+        elif eventType == EVENT_VARIABLE and self.channels is not None:
+            channelName = self.channels["variables"][channel]
+        elif eventType == EVENT_EFFECTOR and self.channels is not None:
+            channelName = self.channels["effectors"][channel]
+        elif eventType == EVENT_SHUTDOWN:
+            channelName = shutdownReasons[channel]
+        if math.isnan(value):
+            value = None
+        return eventNames[eventType], channelName, eventTime, value
@@ -1,15 +1,17 @@
-import time
+from machineClock import realClock
 
 
 class FakeMachine:
-    def __init__(self, name):
+    def __init__(self, name, clock=realClock):
         self.name = name
-        self.machineTime = time.time_ns()
+        self.clock = clock
+        self.machineTime = clock.nowNS()
         self.variables = []
         self.measurers = []
         self.effectors = []
 
     def addVariable(self, variable):
+        variable.clock = self.clock
         variable.valueTime = self.machineTime
         self.variables.append(variable)
 
@@ -21,23 +23,25 @@ class FakeMachine:
 
 
 class FakeMachineVariable:
-    def __init__(self, name, value, setPoint, drift):
+    def __init__(self, name, value, setPoint, drift, clock=realClock):
         self.name = name
         self.value = value
         self.setPoint = setPoint
         self.drift = drift
-        self.valueTime = time.time_ns()
+        self.clock = clock
+        self.valueTime = clock.nowNS()
         self.effectorDelta = 0
 
     def updateValue(self):
-        timeDelta = time.time_ns() - self.valueTime
+        currentTime = self.clock.nowNS()
+        timeDelta = currentTime - self.valueTime
         timeDeltaSeconds = timeDelta / 1000000000
         newValue = self.value + (timeDeltaSeconds * self.effectorDelta)
         newSetPointDelta = self.setPoint - newValue
         driftDelta = 1 - (self.drift ** timeDeltaSeconds)
         newDriftDelta = newSetPointDelta * driftDelta
         self.value = round(newValue + newDriftDelta, 3)
-        self.valueTime = time.time_ns()
+        self.valueTime = currentTime
 
 
 class FakeMachineMeasurer:
@@ -74,10 +78,16 @@ class FakeMachineEffector:
         self.variable.effectorDelta -= self.effectorDelta
 
 
-testMachine = FakeMachine("testMachine")
-testVariable = FakeMachineVariable("Heat", 30, 25, 0.9)
-testMachine.addVariable(testVariable)
-testMeasurer = FakeMachineMeasurer(testVariable)
-testMachine.addMeasurer(testMeasurer)
-testEffector = FakeMachineEffector(testVariable, 100)
-testMachine.addEffector(testEffector)
+def buildTestMachine(clock=realClock):
+    machine = FakeMachine("testMachine", clock)
+    variable = FakeMachineVariable("Heat", 30, 25, 0.9)
+    machine.addVariable(variable)
+    machine.addMeasurer(FakeMachineMeasurer(variable))
+    machine.addEffector(FakeMachineEffector(variable, 100))
+    return machine
+
+
+testMachine = buildTestMachine()
+testVariable = testMachine.variables[0]
+testMeasurer = testMachine.measurers[0]
+testEffector = testMachine.effectors[0]
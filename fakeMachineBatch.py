@@ -0,0 +1,334 @@
+import collections
+import itertools
+import json
+import math
+import warnings
+
+import numpy as np
+
+from configValidator import overlayOverrides
+from stageCompiler import compileStage
+
+defaultParameters = {"initialValue": 30.0, "setPoint": 25.0, "drift": 0.9, "effectorDelta": 100.0}
+variableParameters = ["initialValue", "setPoint", "drift"]
+effectorParameters = ["effectorDelta"]
+mixingModes = {"min": 0, "max": 1, "avg": 2, "median": 3, "rejectOutliers": 4}
+controlModes = {"binary": 1, "binaryInverted": 2}
+
+
+class BatchSimulationException(Exception):
+    pass
+
+
+def expandParameterGrid(parameterGrid):
+    keys = list(parameterGrid.keys())
+    return [dict(zip(keys, x)) for x in itertools.product(*parameterGrid.values())]
+
+
+def resolveParameters(runs, names, parameterKeys):
+    parameters = {}
+    for key in parameterKeys:
+        parameters[key] = np.array([[run.get(name + "." + key, run.get(key, defaultParameters[key])) for name in names]
+                                    for run in runs], dtype=np.float64)
+    return parameters
+
+
+def compileBatchStages(machineConfig, processConfig):
+    nullDrivers = collections.defaultdict(lambda: None)
+    baseConfig = machineConfig
+    if "overrides" in processConfig:
+        baseConfig = overlayOverrides(machineConfig, processConfig["overrides"], "Process override: ")
+    compiledStages = []
+    counter = 0
+    while str(counter) in processConfig["stages"]:
+        stageData = processConfig["stages"][str(counter)]
+        stageConfig = baseConfig
+        if "overrides" in stageData:
+            stageConfig = overlayOverrides(baseConfig, stageData["overrides"], stageData["name"] + " override: ")
+        compiledStages.append(compileStage(stageConfig, stageData, nullDrivers))
+        counter += 1
+    return compiledStages
+
+
+class BatchPlan:
+    def __init__(self, compiledStages):
+        stageCount = len(compiledStages)
+        variables = compiledStages[0].variables
+        measurers = compiledStages[0].measurers
+        effectors = compiledStages[0].effectors
+        self.stageCount = stageCount
+        self.variableNames = [x.name for x in variables]
+        self.measurerNames = [x.name for x in measurers]
+        self.effectorNames = [x.name for x in effectors]
+        self.measurerVariable = np.array([x.variableIndex for x in measurers], dtype=np.int64)
+        self.measurerVariableMatrix = np.zeros((len(measurers), len(variables)), dtype=bool)
+        self.measurerVariableMatrix[np.arange(len(measurers)), self.measurerVariable] = True
+        self.effectorVariable = np.zeros((len(effectors), len(variables)), dtype=np.float64)
+        self.effectorControlIndex = np.zeros(len(effectors), dtype=np.int64)
+        for effector in effectors:
+            if effector.variableIndex is not None:
+                self.effectorVariable[effector.index, effector.variableIndex] = 1
+                self.effectorControlIndex[effector.index] = effector.variableIndex
+        self.measurerActive = np.zeros((stageCount + 1, len(measurers)), dtype=bool)
+        self.measurerIterate = np.ones((stageCount + 1, len(measurers)), dtype=np.int64)
+        self.measurerOffset = np.zeros((stageCount + 1, len(measurers)), dtype=np.int64)
+        self.mixingMode = np.full((stageCount + 1, len(variables)), mixingModes["avg"], dtype=np.int64)
+        self.outlierThreshold = np.zeros((stageCount + 1, len(variables)), dtype=np.float64)
+        self.safeLow = np.full((stageCount + 1, len(variables)), -np.inf)
+        self.safeHigh = np.full((stageCount + 1, len(variables)), np.inf)
+        self.controlMode = np.zeros((stageCount + 1, len(effectors)), dtype=np.int64)
+        self.controlThreshold = np.zeros((stageCount + 1, len(effectors)), dtype=np.float64)
+        self.effectorIterate = np.ones((stageCount + 1, len(effectors)), dtype=np.int64)
+        self.effectorOffset = np.zeros((stageCount + 1, len(effectors)), dtype=np.int64)
+        self.minChangeDelay = np.zeros((stageCount + 1, len(effectors)), dtype=np.int64)
+        self.shutdownSetting = np.zeros((stageCount + 1, len(effectors)), dtype=bool)
+        self.setupValue = np.zeros((stageCount + 1, len(effectors)), dtype=bool)
+        self.hasSetupValue = np.zeros((stageCount + 1, len(effectors)), dtype=bool)
+        self.endTimer = np.full(stageCount + 1, -1, dtype=np.int64)
+        self.recalculateTimers = np.zeros(stageCount + 1, dtype=bool)
+        self.endConditions = []
+        self.shutdownStage = np.zeros(stageCount + 1, dtype=bool)
+        self.shutdownStage[stageCount] = True
+        intervals = []
+        for stageIndex, compiledStage in enumerate(compiledStages):
+            for measurer in compiledStage.measurers:
+                self.measurerActive[stageIndex, measurer.index] = measurer.active
+                self.measurerIterate[stageIndex, measurer.index] = measurer.iterateMS
+                self.measurerOffset[stageIndex, measurer.index] = measurer.offsetMS
+                intervals.extend([measurer.iterateMS, measurer.offsetMS])
+            for variable in compiledStage.variables:
+                self.mixingMode[stageIndex, variable.index] = mixingModes[variable.mixing]
+                self.outlierThreshold[stageIndex, variable.index] = variable.outlierThreshold
+                if variable.checkSafe:
+                    self.safeLow[stageIndex, variable.index] = variable.safeLow
+                    self.safeHigh[stageIndex, variable.index] = variable.safeHigh
+            for effector in compiledStage.effectors:
+                self.shutdownSetting[stageIndex, effector.index] = bool(effector.shutdownSetting)
+                self.minChangeDelay[stageIndex, effector.index] = effector.minChangeDelayMS
+                if effector.minChangeDelayMS:
+                    intervals.append(effector.minChangeDelayMS)
+                if effector.setupValue is not None:
+                    self.hasSetupValue[stageIndex, effector.index] = True
+                    self.setupValue[stageIndex, effector.index] = bool(effector.setupValue)
+                elif effector.controlType in controlModes:
+                    self.controlMode[stageIndex, effector.index] = controlModes[effector.controlType]
+                    self.controlThreshold[stageIndex, effector.index] = effector.controlData
+                    self.effectorIterate[stageIndex, effector.index] = effector.iterateMS
+                    self.effectorOffset[stageIndex, effector.index] = effector.offsetMS
+                    intervals.extend([effector.iterateMS, effector.offsetMS])
+                else:
+                    raise BatchSimulationException("Unsupported control type for batch simulation: " +
+                                                   effector.controlType)
+            self.recalculateTimers[stageIndex] = compiledStage.recalculateTimers
+            if compiledStage.endTimer is not None:
+                self.endTimer[stageIndex] = compiledStage.endTimer
+                intervals.append(compiledStage.endTimer)
+            endWatcher = compiledStage.endWatcher
+            if endWatcher is None:
+                self.endConditions.append(None)
+            else:
+                self.endConditions.append((endWatcher.conditions, endWatcher.requireAll, endWatcher.holdMS))
+                if endWatcher.holdMS:
+                    intervals.append(endWatcher.holdMS)
+            self.shutdownStage[stageIndex] = compiledStage.endControl == "shutdown"
+        self.endConditions.append(None)
+        self.settling = np.array([x is not None for x in self.endConditions])
+        self.robustMixing = (self.mixingMode >= mixingModes["median"]).any(axis=0)
+        self.intervals = intervals
+
+
+class BatchMachine:
+    def __init__(self, plan, variableArrays, effectorArrays):
+        self.values = variableArrays["initialValue"].copy()
+        self.valueTime = np.zeros(self.values.shape, dtype=np.int64)
+        self.setPoint = variableArrays["setPoint"]
+        self.drift = variableArrays["drift"]
+        self.effectorDelta = effectorArrays["effectorDelta"]
+        self.effectorVariable = plan.effectorVariable
+
+    def projected(self, enabled, currentTime):
+        seconds = (currentTime - self.valueTime) / 1000
+        newValues = self.values + seconds * ((enabled * self.effectorDelta) @ self.effectorVariable)
+        return np.round(newValues + (self.setPoint - newValues) * (1 - self.drift ** seconds), 3)
+
+    def advance(self, variableMask, enabled, currentTime):
+        if variableMask.any():
+            self.values = np.where(variableMask, self.projected(enabled, currentTime), self.values)
+            self.valueTime = np.where(variableMask, currentTime, self.valueTime)
+
+    def switch(self, enabled, newEnabled, currentTime):
+        self.advance((enabled != newEnabled) @ self.effectorVariable > 0, enabled, currentTime)
+        return newEnabled
+
+
+def simulateBatch(machineConfig, processConfig, parameterGrid, timeLimitMS=3600000, traceEveryMS=1000):
+    runs = expandParameterGrid(parameterGrid)
+    plan = BatchPlan(compileBatchStages(machineConfig, processConfig))
+    runCount = len(runs)
+    variableCount = len(plan.variableNames)
+    measurerCount = len(plan.measurerNames)
+    stepMS = 0
+    for interval in plan.intervals + [traceEveryMS]:
+        stepMS = math.gcd(stepMS, interval)
+    variableArrays = resolveParameters(runs, plan.variableNames, variableParameters)
+    effectorArrays = resolveParameters(runs, plan.effectorNames, effectorParameters)
+    machine = BatchMachine(plan, variableArrays, effectorArrays)
+    measurerValues = np.full((runCount, measurerCount), np.nan)
+    variableValues = np.full((runCount, variableCount), np.nan)
+    enabled = np.zeros((runCount, len(plan.effectorNames)), dtype=bool)
+    written = np.zeros((runCount, len(plan.effectorNames)), dtype=bool)
+    lastWrite = np.zeros((runCount, len(plan.effectorNames)), dtype=np.int64)
+    pending = np.zeros((runCount, len(plan.effectorNames)), dtype=bool)
+    pendingValue = np.zeros((runCount, len(plan.effectorNames)), dtype=bool)
+    stage = np.zeros(runCount, dtype=np.int64)
+    stageStart = np.zeros(runCount, dtype=np.int64)
+    done = np.zeros(runCount, dtype=bool)
+    tripped = np.zeros(runCount, dtype=bool)
+    endMet = np.zeros(runCount, dtype=bool)
+    endMetSince = np.zeros(runCount, dtype=np.int64)
+    stageTimes = np.full((runCount, plan.stageCount, 2), -1, dtype=np.int64)
+    stageTimes[:, 0, 0] = 0
+    enabled = np.where(plan.hasSetupValue[stage], plan.setupValue[stage], enabled)
+    written |= plan.hasSetupValue[stage]
+    measurerNext = np.where(plan.measurerActive[stage], plan.measurerOffset[stage], -1)
+    effectorNext = np.where(plan.controlMode[stage] > 0, plan.effectorOffset[stage], -1)
+    runIndices = np.arange(runCount)
+    traceTimes = []
+    traces = []
+    currentTime = 0
+    while currentTime <= timeLimitMS and not done.all():
+        if currentTime % traceEveryMS == 0 and (not traceTimes or traceTimes[-1] != currentTime):
+            traceTimes.append(currentTime)
+            traces.append(np.where(done[:, None], machine.values, machine.projected(enabled, currentTime)))
+        anyDue = False
+        measurerDue = (measurerNext == currentTime) & ~done[:, None]
+        if measurerDue.any():
+            anyDue = True
+            measurerNext = np.where(measurerDue, currentTime + plan.measurerIterate[stage], measurerNext)
+            machine.advance(measurerDue @ plan.measurerVariableMatrix, enabled, currentTime)
+            measurerValues = np.where(measurerDue, machine.values[:, plan.measurerVariable], measurerValues)
+            activeValues = np.where(plan.measurerActive[stage], measurerValues, np.nan)
+            tripping = np.zeros(runCount, dtype=bool)
+            for variableIndex in range(variableCount):
+                columns = plan.measurerVariable == variableIndex
+                changed = measurerDue[:, columns].any(axis=1)
+                if not changed.any():
+                    continue
+                columnValues = activeValues[:, columns]
+                mixingMode = plan.mixingMode[stage, variableIndex]
+                with np.errstate(all="ignore"), warnings.catch_warnings():
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    mean = np.nanmean(columnValues, axis=1) if columnValues.shape[1] else np.nan
+                    median = mean
+                    robust = mean
+                    if plan.robustMixing[variableIndex]:
+                        median = np.nanmedian(columnValues, axis=1)
+                        deviations = np.abs(columnValues - median[:, None])
+                        limit = plan.outlierThreshold[stage, variableIndex] * np.nanmedian(deviations, axis=1)
+                        kept = np.where(deviations <= limit[:, None], columnValues, np.nan)
+                        robust = np.where(np.isnan(kept).all(axis=1), median, np.nanmean(kept, axis=1))
+                    modes = ["min", "max", "median", "rejectOutliers"]
+                    mixed = np.select([mixingMode == mixingModes[x] for x in modes],
+                                      [np.fmin.reduce(columnValues, axis=1), np.fmax.reduce(columnValues, axis=1),
+                                       median, robust], mean)
+                updated = changed & ~np.isnan(mixed)
+                variableValues[:, variableIndex] = np.where(updated, mixed, variableValues[:, variableIndex])
+                tripping |= updated & ((mixed < plan.safeLow[stage, variableIndex]) |
+                                       (mixed > plan.safeHigh[stage, variableIndex]))
+            tripping &= ~done
+            if tripping.any():
+                trippedRuns = runIndices[tripping]
+                stageTimes[trippedRuns, stage[trippedRuns], 1] = currentTime
+                enabled = machine.switch(enabled, np.where(tripping[:, None], plan.shutdownSetting[stage], enabled),
+                                         currentTime)
+                tripped |= tripping
+                done |= tripping
+        controlMode = plan.controlMode[stage]
+        effectorDue = (effectorNext == currentTime) & ~done[:, None]
+        if effectorDue.any():
+            anyDue = True
+            effectorNext = np.where(effectorDue, currentTime + plan.effectorIterate[stage], effectorNext)
+            controlValues = variableValues[:, plan.effectorControlIndex]
+            above = controlValues > plan.controlThreshold[stage]
+            output = np.where(controlMode == controlModes["binary"], above, ~above)
+            output = np.where(np.isnan(controlValues), plan.shutdownSetting[stage], output)
+            unchanged = effectorDue & (output == enabled)
+            holding = (effectorDue & ~unchanged & written &
+                       (currentTime < lastWrite + plan.minChangeDelay[stage]))
+            sending = effectorDue & ~unchanged & ~holding
+            pendingValue = np.where(holding, output, pendingValue)
+            pending = (pending | holding) & ~unchanged & ~sending
+            enabled = machine.switch(enabled, np.where(sending, output, enabled), currentTime)
+            lastWrite = np.where(sending, currentTime, lastWrite)
+            written |= sending
+        releasing = pending & (currentTime >= lastWrite + plan.minChangeDelay[stage]) & ~done[:, None]
+        if releasing.any():
+            anyDue = True
+            sending = releasing & (pendingValue != enabled)
+            enabled = machine.switch(enabled, np.where(sending, pendingValue, enabled), currentTime)
+            lastWrite = np.where(sending, currentTime, lastWrite)
+            pending &= ~releasing
+        timerEnd = (plan.endTimer[stage] >= 0) & (currentTime - stageStart >= plan.endTimer[stage])
+        ending = timerEnd & ~done
+        for stageIndex in range(plan.stageCount):
+            if plan.endConditions[stageIndex] is None:
+                continue
+            conditions, requireAll, holdMS = plan.endConditions[stageIndex]
+            inStage = (stage == stageIndex) & ~done
+            if anyDue:
+                met = np.full(runCount, requireAll)
+                for variableIndex, low, high in conditions:
+                    satisfied = (variableValues[:, variableIndex] >= low) & (variableValues[:, variableIndex] <= high)
+                    met = met & satisfied if requireAll else met | satisfied
+                endMetSince = np.where(inStage & met & ~endMet, currentTime, endMetSince)
+                endMet = np.where(inStage, met, endMet)
+            ending |= inStage & endMet & (currentTime - endMetSince >= holdMS)
+        if ending.any():
+            endingRuns = runIndices[ending]
+            stageTimes[endingRuns, stage[endingRuns], 1] = currentTime
+            stage[endingRuns] += 1
+            stageStart[endingRuns] = currentTime
+            started = endingRuns[stage[endingRuns] < plan.stageCount]
+            stageTimes[started, stage[started], 0] = currentTime
+            setupMask = ending[:, None] & plan.hasSetupValue[stage]
+            enabled = machine.switch(enabled, np.where(setupMask, plan.setupValue[stage], enabled), currentTime)
+            lastWrite = np.where(setupMask, currentTime, lastWrite)
+            written |= setupMask
+            pending &= ~ending[:, None]
+            endMet &= ~ending
+            endingColumn = ending[:, None]
+            measurerActive = plan.measurerActive[stage]
+            measurerNext = np.where(endingColumn & (plan.recalculateTimers[stage, None] | ~measurerActive), -1,
+                                    measurerNext)
+            measurerNext = np.where(endingColumn & measurerActive & (measurerNext < 0),
+                                    currentTime + plan.measurerOffset[stage], measurerNext)
+            effectorScheduled = plan.controlMode[stage] > 0
+            effectorNext = np.where(endingColumn & (plan.recalculateTimers[stage, None] | ~effectorScheduled), -1,
+                                    effectorNext)
+            effectorNext = np.where(endingColumn & effectorScheduled & (effectorNext < 0),
+                                    currentTime + plan.effectorOffset[stage], effectorNext)
+            shutdownRuns = ending & plan.shutdownStage[stage] & ~plan.settling[stage]
+            enabled = machine.switch(enabled, np.where(shutdownRuns[:, None], plan.shutdownSetting[stage], enabled),
+                                     currentTime)
+            finishing = shutdownRuns & (stage < plan.stageCount)
+            stageTimes[runIndices[finishing], stage[finishing], 1] = currentTime
+            done |= shutdownRuns
+            restarting = ending & ~done & (plan.endTimer[stage] == 0)
+            restarting |= ~done & ((measurerNext == currentTime).any(axis=1) |
+                                   (effectorNext == currentTime).any(axis=1))
+            if restarting.any():
+                continue
+        currentTime += stepMS
+    traceArray = np.array(traces).transpose(1, 2, 0)
+    return {"parameters": runs, "stageTimes": stageTimes, "completed": done & ~tripped, "tripped": tripped,
+            "traceTimes": np.array(traceTimes),
+            "traces": {x: traceArray[:, i, :] for i, x in enumerate(plan.variableNames)}}
+
+
+if __name__ == "__main__":
+    fakeMachineConfig = json.loads(open("fakeMachineConfig.json").read())
+    fakeProcessConfig = json.loads(open("fakeProcessConfig.json").read())
+    result = simulateBatch(fakeMachineConfig, fakeProcessConfig, {"drift": [0.5, 0.9, 0.99],
+                                                                  "effectorDelta": [10, 50, 100]})
+    for run, stageTime in zip(result["parameters"], result["stageTimes"]):
+        print(run, stageTime.tolist())
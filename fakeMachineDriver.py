@@ -1,23 +1,55 @@
-from fakeMachine import testMeasurer, testEffector
+import asyncio
+import time
 
+from fakeMachine import testMachine
 
-def pumpWater(x):
-    print("Pumping water: " + str(x))
 
+def buildFakeDeviceDrivers(machine, log=print):
+    measurer = machine.measurers[0]
+    effector = machine.effectors[0]
 
-def setHeater(x):
-    testEffector.setEffector(x)
-    print("Setting heater: " + str(x))
+    def pumpWater(x):
+        if log is not None:
+            log("Pumping water: " + str(x))
 
+    def setHeater(x):
+        effector.setEffector(x)
+        if log is not None:
+            log("Setting heater: " + str(x))
 
-def measureTemp():
-    temperature = testMeasurer.measureValue()
-    print(temperature)
-    return temperature
+    def measureTemp():
+        temperature = measurer.measureValue()
+        if log is not None:
+            log(temperature)
+        return temperature
 
+    def readTempChannels(channels):
+        return [measureTemp()] * len(channels)
 
-fakeDeviceDrivers = {
-    "heatMeasurer": measureTemp,
-    "heatEffector": setHeater,
-    "pumpControl": pumpWater
-}
+    measureTemp.readChannels = readTempChannels
+
+    return {
+        "heatMeasurer": measureTemp,
+        "heatEffector": setHeater,
+        "pumpControl": pumpWater
+    }
+
+
+def delayedDriver(driver, delayMS):
+    def delayedCall(*args):
+        time.sleep(delayMS / 1000)
+        return driver(*args)
+    return delayedCall
+
+
+def asyncDelayedDriver(driver, delayMS):
+    async def delayedCall(*args):
+        await asyncio.sleep(delayMS / 1000)
+        return driver(*args)
+    return delayedCall
+
+
+fakeDeviceDrivers = buildFakeDeviceDrivers(testMachine, None)
+measureTemp = fakeDeviceDrivers["heatMeasurer"]
+setHeater = fakeDeviceDrivers["heatEffector"]
+pumpWater = fakeDeviceDrivers["pumpControl"]
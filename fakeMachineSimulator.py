@@ -0,0 +1,62 @@
+import json
+
+from machineClock import VirtualClock
+from fakeMachine import buildTestMachine
+from fakeMachineDriver import buildFakeDeviceDrivers
+from machineEngine import runMachineProcess
+
+
+class ClockedQueue:
+    def __init__(self, clock):
+        self.clock = clock
+        self.messages = []
+
+    def put(self, message):
+        self.messages.append((self.clock.nowMS(), message))
+
+
+class ClockLimit:
+    def __init__(self, clock, limitMS):
+        self.clock = clock
+        self.limitMS = limitMS
+
+    def is_set(self):
+        return self.clock.nowMS() >= self.limitMS
+
+
+def simulateProcess(machineConfig, processConfig, machineFactory=buildTestMachine,
+                    driverFactory=buildFakeDeviceDrivers, timeLimitMS=86400000, **engineOptions):
+    clock = VirtualClock()
+    machine = machineFactory(clock)
+    deviceDrivers = driverFactory(machine, None)
+    messageQueue = ClockedQueue(clock)
+    runMachineProcess(machineConfig, processConfig, deviceDrivers, messageQueue,
+                      stopEvent=ClockLimit(clock, timeLimitMS), clock=clock, **engineOptions)
+    stageTimes, shutdown = summarizeMessages(messageQueue.messages)
+    return {"durationMS": clock.nowMS(), "stageTimes": stageTimes, "shutdown": shutdown,
+            "messages": messageQueue.messages, "machine": machine}
+
+
+def summarizeMessages(messages):
+    stageTimes = {}
+    shutdown = None
+    for messageTime, message in messages:
+        if type(message).__name__ != "list":
+            continue
+        if message[0] == "STAGE INIT":
+            stageTimes[message[1]] = [messageTime, None]
+            if message[1] - 1 in stageTimes:
+                stageTimes[message[1] - 1][1] = messageTime
+        elif message[0] == "SHUTDOWN":
+            shutdown = message[1:]
+            for stageTime in stageTimes.values():
+                if stageTime[1] is None:
+                    stageTime[1] = messageTime
+    return stageTimes, shutdown
+
+
+if __name__ == "__main__":
+    fakeMachineConfig = json.loads(open("fakeMachineConfig.json").read())
+    fakeProcessConfig = json.loads(open("fakeProcessConfig.json").read())
+    result = simulateProcess(fakeMachineConfig, fakeProcessConfig)
+    print(result["shutdown"], result["durationMS"], result["stageTimes"])
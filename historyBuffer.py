@@ -0,0 +1,106 @@
+import array
+import collections
+
+
+class RingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array.array("q", bytes(8 * capacity))
+        self.values = array.array("d", bytes(8 * capacity))
+        self.timestampView = memoryview(self.timestamps)
+        self.valueView = memoryview(self.values)
+        self.count = 0
+        self.total = 0.0
+        self.minIndices = collections.deque()
+        self.maxIndices = collections.deque()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, value):
+        position = self.count % self.capacity
+        if self.count >= self.capacity:
+            self.total -= self.values[position]
+        self.timestamps[position] = timestamp
+        self.values[position] = value
+        self.total += value
+        if position == self.capacity - 1:
+            self.total = sum(self.values)
+        expired = self.count - self.capacity
+        values = self.values
+        capacity = self.capacity
+        minIndices = self.minIndices
+        while minIndices and values[minIndices[-1] % capacity] >= value:
+            minIndices.pop()
+        minIndices.append(self.count)
+        if minIndices[0] <= expired:
+            minIndices.popleft()
+        maxIndices = self.maxIndices
+        while maxIndices and values[maxIndices[-1] % capacity] <= value:
+            maxIndices.pop()
+        maxIndices.append(self.count)
+        if maxIndices[0] <= expired:
+            maxIndices.popleft()
+        self.count += 1
+
+    def latest(self):
+        if self.count == 0:
+            return None, None
+        position = (self.count - 1) % self.capacity
+        return self.timestamps[position], self.values[position]
+
+    def min(self):
+        if self.count == 0:
+            return None
+        return self.values[self.minIndices[0] % self.capacity]
+
+    def max(self):
+        if self.count == 0:
+            return None
+        return self.values[self.maxIndices[0] % self.capacity]
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / len(self)
+
+    def segments(self, length=None):
+        if length is not None and length < 0:
+            raise ValueError("Window length must not be negative")
+        size = len(self)
+        if length is None or length > size:
+            length = size
+        end = self.count % self.capacity
+        start = end - length
+        if start >= 0:
+            return [(self.timestampView[start:end], self.valueView[start:end])]
+        return [(self.timestampView[self.capacity + start:], self.valueView[self.capacity + start:]),
+                (self.timestampView[:end], self.valueView[:end])]
+
+    def window(self, length=None):
+        timestamps = []
+        values = []
+        for timestampSegment, valueSegment in self.segments(length):
+            timestamps.extend(timestampSegment)
+            values.extend(valueSegment)
+        return timestamps, values
+
+    def since(self, timestamp):
+        length = 0
+        size = len(self)
+        while length < size and self.timestamps[(self.count - length - 1) % self.capacity] >= timestamp:
+            length += 1
+        return length
+
+    def windowMin(self, length):
+        return min((min(x[1]) for x in self.segments(length) if len(x[1])), default=None)
+
+    def windowMax(self, length):
+        return max((max(x[1]) for x in self.segments(length) if len(x[1])), default=None)
+
+    def windowMean(self, length):
+        segments = self.segments(length)
+        count = sum(len(x[1]) for x in segments)
+        if count == 0:
+            return None
+        return sum(sum(x[1]) for x in segments) / count
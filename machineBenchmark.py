@@ -0,0 +1,205 @@
+import argparse
+import json
+import platform
+import time
+
+from machineClock import RealClock, PrecisionClock, VirtualClock
+from fakeMachine import FakeMachine, FakeMachineVariable, FakeMachineMeasurer, FakeMachineEffector
+from configValidator import validateFullConfig, ValidationCache
+from machineEngine import createProcessData, startStage, processStep
+
+benchmarkFormatVersion = 1
+mixingTypes = ["min", "max", "avg"]
+
+
+class BenchmarkClock:
+    def __init__(self, clock):
+        self.clock = clock
+        self.wokeNS = time.perf_counter_ns()
+
+    def nowNS(self):
+        return self.clock.nowNS()
+
+    def nowMS(self):
+        return self.clock.nowMS()
+
+    def wallTimeMS(self):
+        return self.clock.wallTimeMS()
+
+    def sleepUntilMS(self, targetMS, stopEvent=None):
+        currentTime = self.clock.sleepUntilMS(targetMS, stopEvent)
+        self.wokeNS = time.perf_counter_ns()
+        return currentTime
+
+    def timingStats(self):
+        if hasattr(self.clock, "timingStats"):
+            return self.clock.timingStats()
+        return None
+
+
+def generateMachineConfig(variableCount, measurersPerVariable, effectorsPerVariable, iterateMS):
+    machineConfig = {"name": "benchmarkMachine", "variables": {}, "measurers": {}, "effectors": {}}
+    for variableIndex in range(variableCount):
+        variableName = "variable" + str(variableIndex)
+        machineConfig["variables"][variableName] = {"name": variableName, "visible": True,
+                                                    "sensorMixing": mixingTypes[variableIndex % len(mixingTypes)]}
+        for probeIndex in range(measurersPerVariable):
+            measurerName = variableName + "Probe" + str(probeIndex)
+            machineConfig["measurers"][measurerName] = {
+                "name": measurerName, "variable": variableName, "driverKey": measurerName, "active": True,
+                "iterateMS": iterateMS,
+                "offsetMS": (variableIndex + probeIndex * iterateMS // measurersPerVariable) % iterateMS
+            }
+        for controllerIndex in range(effectorsPerVariable):
+            effectorName = variableName + "Controller" + str(controllerIndex)
+            machineConfig["effectors"][effectorName] = {
+                "name": effectorName, "driverKey": effectorName, "active": True, "shutdownSetting": 0,
+                "controlType": ["binaryInverted", "binary"][controllerIndex % 2], "controlVariable": variableName,
+                "controlBinaryThreshold": 50, "iterateMS": iterateMS,
+                "offsetMS": (variableIndex + controllerIndex + iterateMS // 2) % iterateMS
+            }
+    return machineConfig
+
+
+def generateProcessConfig(machineConfig, stageCount, stageDurationMS):
+    processConfig = {"name": "benchmarkProcess", "forMachine": machineConfig["name"], "stages": {}}
+    effectorNames = list(machineConfig["effectors"].keys())
+    for stageIndex in range(stageCount):
+        stageData = {"name": "stage" + str(stageIndex), "stageEndControl": "time", "stageEndTimer": stageDurationMS,
+                     "recalculateTimers": False}
+        if stageIndex % 2:
+            stageData["overrides"] = {"effectors": {x: {"controlBinaryThreshold": 40 + stageIndex}
+                                                    for x in effectorNames[::2]}}
+        processConfig["stages"][str(stageIndex)] = stageData
+    return processConfig
+
+
+def buildBenchmarkDrivers(machineConfig, clock):
+    machine = FakeMachine(machineConfig["name"], clock)
+    fakeVariables = {}
+    for variableName in machineConfig["variables"]:
+        fakeVariables[variableName] = FakeMachineVariable(variableName, 50, 45, 0.9)
+        machine.addVariable(fakeVariables[variableName])
+    deviceDrivers = {}
+    for measurerName, measurerData in machineConfig["measurers"].items():
+        measurer = FakeMachineMeasurer(fakeVariables[measurerData["variable"]])
+        machine.addMeasurer(measurer)
+        deviceDrivers[measurerName] = measurer.measureValue
+    for effectorName, effectorData in machineConfig["effectors"].items():
+        effector = FakeMachineEffector(fakeVariables[effectorData["controlVariable"]], 10)
+        machine.addEffector(effector)
+        deviceDrivers[effectorName] = effector.setEffector
+    return deviceDrivers
+
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return None
+    return sortedValues[min(len(sortedValues) - 1, int(fraction * len(sortedValues)))]
+
+
+def benchmarkConfig(variableCount, measurersPerVariable=2, effectorsPerVariable=1, stageCount=4,
+                    stageDurationMS=10000, iterateMS=100, realTime=False, precision=False):
+    if precision:
+        clock = BenchmarkClock(PrecisionClock())
+    else:
+        clock = BenchmarkClock(RealClock() if realTime else VirtualClock())
+    machineConfig = generateMachineConfig(variableCount, measurersPerVariable, effectorsPerVariable, iterateMS)
+    processConfig = generateProcessConfig(machineConfig, stageCount, stageDurationMS)
+    deviceDrivers = buildBenchmarkDrivers(machineConfig, clock)
+
+    validationStart = time.perf_counter_ns()
+    valid, message = validateFullConfig(machineConfig, processConfig, deviceDrivers, cache=None)
+    validationNS = time.perf_counter_ns() - validationStart
+    if not valid:
+        raise ValueError("Generated benchmark config is invalid: " + message)
+    cache = ValidationCache()
+    validateFullConfig(machineConfig, processConfig, deviceDrivers, cache=cache)
+    validationStart = time.perf_counter_ns()
+    validateFullConfig(machineConfig, processConfig, deviceDrivers, cache=cache)
+    cachedValidationNS = time.perf_counter_ns() - validationStart
+
+    processData = createProcessData(machineConfig, clock)
+    tickLatencies = []
+    tickLags = []
+    stageSetupLatencies = []
+    runStart = time.perf_counter_ns()
+    for stageIndex in range(stageCount):
+        setupStart = time.perf_counter_ns()
+        compiledStage = startStage(processData, machineConfig, processConfig["stages"][str(stageIndex)],
+                                   deviceDrivers)
+        stageSetupLatencies.append(time.perf_counter_ns() - setupStart)
+        stageEnd = False
+        while not stageEnd:
+            stageEnd, processData = processStep(processData, compiledStage)
+            tickLatencies.append(time.perf_counter_ns() - clock.wokeNS)
+            tickLags.append(processData["tickLag"])
+    runNS = time.perf_counter_ns() - runStart
+    processingNS = sum(tickLatencies)
+
+    tickLatencies.sort()
+    tickLags.sort()
+    return {
+        "variables": variableCount,
+        "measurers": len(machineConfig["measurers"]),
+        "effectors": len(machineConfig["effectors"]),
+        "stages": stageCount,
+        "realTime": realTime or precision,
+        "precision": precision,
+        "ticks": len(tickLatencies),
+        "runSeconds": runNS / 1e9,
+        "ticksPerSecond": len(tickLatencies) / (processingNS / 1e9) if processingNS else None,
+        "tickLatencyP50US": percentile(tickLatencies, 0.5) / 1000,
+        "tickLatencyP99US": percentile(tickLatencies, 0.99) / 1000,
+        "tickLatencyMaxUS": tickLatencies[-1] / 1000,
+        "jitterP50MS": percentile(tickLags, 0.5),
+        "jitterP99MS": percentile(tickLags, 0.99),
+        "jitterMaxMS": tickLags[-1],
+        "stageSetupMeanUS": sum(stageSetupLatencies) / len(stageSetupLatencies) / 1000,
+        "validationMS": validationNS / 1e6,
+        "cachedValidationMS": cachedValidationNS / 1e6,
+        "timing": clock.timingStats()
+    }
+
+
+def runBenchmarks(sizes, label="", **options):
+    return {
+        "formatVersion": benchmarkFormatVersion,
+        "label": label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": options,
+        "results": [benchmarkConfig(x, **options) for x in sizes]
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the machineEngine tick loop and config validator.")
+    parser.add_argument("--sizes", default="1,10,100", help="Comma separated variable counts to benchmark")
+    parser.add_argument("--measurers", type=int, default=2, help="Measurers per variable")
+    parser.add_argument("--effectors", type=int, default=1, help="Effectors per variable")
+    parser.add_argument("--stages", type=int, default=4)
+    parser.add_argument("--stage-ms", type=int, default=10000)
+    parser.add_argument("--iterate-ms", type=int, default=100)
+    parser.add_argument("--realtime", action="store_true", help="Run against the real clock to measure jitter")
+    parser.add_argument("--precision", action="store_true",
+                        help="Run against the precision clock to compare its jitter and spin cost")
+    parser.add_argument("--label", default="")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    arguments = parser.parse_args()
+    benchmarkResults = runBenchmarks([int(x) for x in arguments.sizes.split(",")], arguments.label,
+                                     measurersPerVariable=arguments.measurers,
+                                     effectorsPerVariable=arguments.effectors, stageCount=arguments.stages,
+                                     stageDurationMS=arguments.stage_ms, iterateMS=arguments.iterate_ms,
+                                     realTime=arguments.realtime, precision=arguments.precision)
+    for result in benchmarkResults["results"]:
+        print("{variables:>6} vars {ticks:>8} ticks {ticksPerSecond:>12.0f} ticks/s  p50 {tickLatencyP50US:>9.1f}us  "
+              "p99 {tickLatencyP99US:>9.1f}us  jitter p99 {jitterP99MS}ms  validation {validationMS:.2f}ms "
+              "(cached {cachedValidationMS:.2f}ms)".format(**result))
+        if result["timing"] is not None:
+            print("       late p50 {lateP50US:.1f}us  p99 {lateP99US:.1f}us  max {lateMaxUS:.1f}us  "
+                  "spin {spinFraction:.1%} of wait  margin {spinMarginUS:.0f}us".format(**result["timing"]))
+    if arguments.output:
+        with open(arguments.output, "w") as outputFile:
+            json.dump(benchmarkResults, outputFile, indent=2)
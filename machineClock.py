@@ -0,0 +1,111 @@
+import collections
+import time
+
+
+class RealClock:
+    def nowNS(self):
+        return time.perf_counter_ns()
+
+    def nowMS(self):
+        return time.perf_counter_ns() // 1000000
+
+    def wallTimeMS(self):
+        return time.time_ns() // 1000000
+
+    def sleepUntilMS(self, targetMS, stopEvent=None):
+        currentTime = time.perf_counter_ns() // 1000000
+        while targetMS > currentTime:
+            if stopEvent is None:
+                time.sleep((targetMS - currentTime) / 1000)
+            elif stopEvent.wait((targetMS - currentTime) / 1000):
+                return time.perf_counter_ns() // 1000000
+            currentTime = time.perf_counter_ns() // 1000000
+        return currentTime
+
+
+class PrecisionClock(RealClock):
+    def __init__(self, spinNS=500000, minSpinNS=50000, maxSpinNS=5000000, yieldSpin=True, sampleCount=4096):
+        self.spinNS = spinNS
+        self.minSpinNS = minSpinNS
+        self.maxSpinNS = maxSpinNS
+        self.yieldSpin = yieldSpin
+        self.lateness = collections.deque(maxlen=sampleCount)
+        self.resetStats()
+
+    def resetStats(self):
+        self.lateness.clear()
+        self.wakeups = 0
+        self.sleepTotalNS = 0
+        self.spinTotalNS = 0
+
+    def sleepUntilNS(self, targetNS, stopEvent=None):
+        currentNS = time.perf_counter_ns()
+        coarseNS = targetNS - currentNS - self.spinNS
+        if coarseNS > 0:
+            if stopEvent is None:
+                time.sleep(coarseNS / 1000000000)
+            elif stopEvent.wait(coarseNS / 1000000000):
+                return time.perf_counter_ns()
+            wokeNS = time.perf_counter_ns()
+            self.adaptSpin(wokeNS - currentNS - coarseNS)
+            self.sleepTotalNS += wokeNS - currentNS
+            currentNS = wokeNS
+        spinStartNS = currentNS
+        while currentNS < targetNS:
+            if self.yieldSpin:
+                time.sleep(0)
+            currentNS = time.perf_counter_ns()
+        self.spinTotalNS += currentNS - spinStartNS
+        self.wakeups += 1
+        self.lateness.append(currentNS - targetNS)
+        return currentNS
+
+    def sleepUntilMS(self, targetMS, stopEvent=None):
+        return self.sleepUntilNS(targetMS * 1000000, stopEvent) // 1000000
+
+    def adaptSpin(self, oversleepNS):
+        if oversleepNS > self.spinNS:
+            self.spinNS += self.spinNS // 4
+        else:
+            self.spinNS -= self.spinNS // 64
+        self.spinNS = min(self.maxSpinNS, max(self.minSpinNS, self.spinNS))
+
+    def timingStats(self, reset=False):
+        lateness = sorted(self.lateness)
+        waitedNS = self.sleepTotalNS + self.spinTotalNS
+        stats = {"wakeups": self.wakeups, "spinMarginUS": self.spinNS / 1000,
+                 "spinFraction": self.spinTotalNS / waitedNS if waitedNS else 0,
+                 "lateP50US": None, "lateP99US": None, "lateMaxUS": None}
+        if lateness:
+            stats["lateP50US"] = lateness[len(lateness) // 2] / 1000
+            stats["lateP99US"] = lateness[min(len(lateness) - 1, int(0.99 * len(lateness)))] / 1000
+            stats["lateMaxUS"] = lateness[-1] / 1000
+        if reset:
+            self.resetStats()
+        return stats
+
+
+class VirtualClock:
+    def __init__(self, startNS=0):
+        self.timeNS = startNS
+
+    def nowNS(self):
+        return self.timeNS
+
+    def nowMS(self):
+        return self.timeNS // 1000000
+
+    def wallTimeMS(self):
+        return self.timeNS // 1000000
+
+    def sleepUntilMS(self, targetMS, stopEvent=None):
+        if targetMS * 1000000 > self.timeNS:
+            self.timeNS = targetMS * 1000000
+        return self.timeNS // 1000000
+
+    def advanceMS(self, deltaMS):
+        self.timeNS += deltaMS * 1000000
+        return self.timeNS // 1000000
+
+
+realClock = RealClock()
@@ -1,191 +1,343 @@
-import time
 import json
+import os
 import queue
-import copy
+import time
 
-from fakeMachineDriver import deviceDrivers
-from configValidator import validateFullConfig, applyOverrides
+from configValidator import validateFullConfig, overlayOverrides
+from eventScheduler import EventScheduler
+from driverExecutor import DriverExecutor, readMeasurers
+from stageCompiler import compileStage, PIDState
+from machineClock import realClock
+from historyBuffer import RingBuffer
+from engineInstrumentation import EngineInstrumentation
+from eventStream import EventStreamWriter, combineSinks
+from sharedState import SharedStatePublisher
+from effectorOutput import EffectorOutput
+from runRecorder import RunRecorder, RecorderException
+from driverRegistry import loadDriverRegistry, DriverRegistryException
+from processCheckpoint import CheckpointWriter, CheckpointException, checkpointKey, loadCheckpoint, \
+    restoreCheckpoint, rebaseSchedule
 
 
 class ProcessException(Exception):
     pass
 
 
-def runMachineProcess(machineConfig, processConfig, deviceDrivers, queue):
+def runMachineProcess(machineConfig, processConfig, deviceDrivers, queue, driverWorkers=0, driverTimeoutMS=1000,
+                      stopEvent=None, lagReportMS=1000, clock=realClock, historyCapacity=1024,
+                      instrumentationReportMS=0, eventSink=None, eventFlushMS=0, sharedStateName=None,
+                      recordPath=None, checkpointPath=None, checkpointMS=5000, resume=False,
+                      resumeDowntimeMS=None):
     queue.put("START")
+    driverExecutor = None
+    if driverWorkers > 0:
+        driverExecutor = DriverExecutor(driverWorkers, driverTimeoutMS)
+    instrumentation = None
+    if instrumentationReportMS > 0:
+        instrumentation = EngineInstrumentation(instrumentationReportMS)
+    recorder = None
+    if recordPath is not None:
+        recorder = RunRecorder(recordPath, resume=resume and checkpointPath is not None and
+                               os.path.exists(checkpointPath))
+        eventSink = combineSinks(eventSink, recorder.write)
+    eventStream = None
+    if eventSink is not None:
+        eventStream = EventStreamWriter(eventSink, eventFlushMS)
+    sharedState = None
+    checkpointWriter = None
+    discardCheckpoint = False
     try:
         valid, message = validateFullConfig(machineConfig, processConfig, deviceDrivers)
         if not valid:
-            queue.put(["SHUTDOWN", "VALIDATION ERROR", message])
+            reportShutdown(queue, eventStream, clock, "VALIDATION ERROR", message)
             return
         queue.put("VALIDATION OK")
         stageCounter = 0
+        checkpoint = None
+        if checkpointPath is not None:
+            configKey = checkpointKey(machineConfig, processConfig, deviceDrivers)
+            if resume:
+                checkpoint = loadCheckpoint(checkpointPath, configKey)
+            checkpointWriter = CheckpointWriter(checkpointPath, checkpointMS, configKey)
         if "overrides" in processConfig:
-            applyOverrides(machineConfig, processConfig["overrides"])
-        timers = {}
-        variableData = {x: {"value": None, "measurers": []} for x in machineConfig["variables"].keys()}
-        measurerData = {x: {"value": None} for x in machineConfig["measurers"].keys()}
-        startTime = time.perf_counter_ns() // 1000000
-        stepTime = startTime
-        processData = {"startTime": startTime, "stepTime": stepTime, "timers": timers, "variableData": variableData,
-                       "measurerData": measurerData}
+            machineConfig = overlayOverrides(machineConfig, processConfig["overrides"], "Process override: ")
+        if instrumentation is not None:
+            deviceDrivers = instrumentation.instrumentDrivers(deviceDrivers)
+        processData = createProcessData(machineConfig, clock, driverExecutor, historyCapacity, instrumentation,
+                                        eventStream, stopEvent)
+        if eventStream is not None:
+            eventStream.writeChannels(processData)
+        if sharedStateName is not None:
+            sharedState = SharedStatePublisher(processData, sharedStateName or None)
+            processData["sharedState"] = sharedState
+            queue.put(["SHARED STATE", sharedState.name])
+        lagReportTime = processData["startTime"] + lagReportMS
+        timingStats = getattr(clock, "timingStats", None)
+        maxTickLag = 0
+        if checkpoint is not None:
+            stageCounter = checkpoint["stage"]
+            stageStartTime = restoreCheckpoint(processData, checkpoint, resumeDowntimeMS)
+            queue.put(["RESUME", stageCounter, checkpoint["stageElapsedMS"]])
         while str(stageCounter) in processConfig["stages"]:
             queue.put(["STAGE INIT", stageCounter])
+            if eventStream is not None:
+                eventStream.stage(stageCounter, processData["stepTime"])
             stageData = processConfig["stages"][str(stageCounter)]
-            stageConfig = copy.deepcopy(machineConfig)
-            if "overrides" in stageData:
-                applyOverrides(stageConfig, stageData["overrides"])
-            if "variableTargets" in stageData:
-                for variableName, variableTarget in stageData["variableTargets"].items():
-                    variableData[variableName]["target"] = variableTarget
-            processData = stageSetup(processData, stageConfig, stageData, deviceDrivers)
-            stageEnd = False
-            loopCounter = 0
+            compiledStage = startStage(processData, machineConfig, stageData, deviceDrivers)
+            if checkpoint is not None:
+                rebaseSchedule(processData, checkpoint)
+                checkpoint = None
+            else:
+                stageStartTime = processData["stepTime"]
+            if checkpointWriter is not None:
+                checkpointWriter.checkpoint(processData, stageCounter, stageStartTime)
+            if sharedState is not None:
+                sharedState.publishAll(processData, stageCounter, processData["stepTime"])
+            stageEnd = compiledStage.endControl == "shutdown" and compiledStage.endWatcher is None
             while not stageEnd:
-                stageEnd, processData = processStep(processData, stageConfig, stageData, deviceDrivers)
-                loopCounter += 1
-                if loopCounter > 9:
-                    raise ProcessException("Loop counter exceeded")
+                if stopEvent is not None and stopEvent.is_set():
+                    shutdownEffectors(processData, compiledStage)
+                    reportShutdown(queue, eventStream, clock, "STOPPED")
+                    return
+                stageEnd, processData = processStep(processData, compiledStage)
+                if processData["safetyTrip"] is not None:
+                    variableIndex, variableValue = processData["safetyTrip"]
+                    discardCheckpoint = True
+                    reportShutdown(queue, eventStream, clock, "SAFETY SHUTDOWN",
+                                   processData["variableNames"][variableIndex], variableValue)
+                    return
+                if checkpointWriter is not None and checkpointWriter.due(processData["stepTime"]):
+                    checkpointWriter.checkpoint(processData, stageCounter, stageStartTime)
+                maxTickLag = max(maxTickLag, processData["tickLag"])
+                if processData["stepTime"] >= lagReportTime:
+                    queue.put(["TICK LAG", maxTickLag])
+                    if timingStats is not None:
+                        queue.put(["TIMING", timingStats(reset=True)])
+                    lagReportTime = processData["stepTime"] + lagReportMS
+                    maxTickLag = 0
+                if instrumentation is not None and instrumentation.reportDue(processData["stepTime"]):
+                    queue.put(["INSTRUMENTATION", instrumentation.report(processData["stepTime"])])
             stageCounter += 1
-    except ProcessException as e:
-        queue.put(["SHUTDOWN", "PROCESS ERROR", str(e)])
+        if instrumentation is not None:
+            queue.put(["INSTRUMENTATION", instrumentation.report(processData["stepTime"])])
+        discardCheckpoint = True
+        reportShutdown(queue, eventStream, clock, "PROCESS COMPLETE")
+    except (ProcessException, DriverRegistryException, CheckpointException) as e:
+        reportShutdown(queue, eventStream, clock, "PROCESS ERROR", str(e))
         return
+    finally:
+        if driverExecutor is not None:
+            driverExecutor.shutdown()
+        if sharedState is not None:
+            sharedState.close()
+        if recorder is not None:
+            try:
+                recorder.close()
+            except (RecorderException, OSError) as e:
+                queue.put(["SHUTDOWN", "PROCESS ERROR", str(e)])
+        if checkpointWriter is not None:
+            try:
+                checkpointWriter.close(discardCheckpoint)
+            except (CheckpointException, OSError) as e:
+                queue.put(["SHUTDOWN", "PROCESS ERROR", str(e)])
+
+
+def reportShutdown(queue, eventStream, clock, reason, *details):
+    queue.put(["SHUTDOWN", reason, *details])
+    if eventStream is not None:
+        eventStream.shutdown(reason, clock.nowMS())
+
+
+def createProcessData(machineConfig, clock=realClock, driverExecutor=None, historyCapacity=1024,
+                      instrumentation=None, eventStream=None, stopEvent=None):
+    startTime = clock.nowMS()
+    effectorOutput = EffectorOutput(len(machineConfig["effectors"]), eventStream)
+    return {"startTime": startTime, "stepTime": startTime, "scheduler": EventScheduler(), "clock": clock,
+            "driverExecutor": driverExecutor, "instrumentation": instrumentation,
+            "eventStream": eventStream, "stopEvent": stopEvent, "sharedState": None, "effectorOutput": effectorOutput,
+            "tickLag": 0, "safetyTrip": None,
+            "variableNames": list(machineConfig["variables"].keys()),
+            "measurerNames": list(machineConfig["measurers"].keys()),
+            "effectorNames": list(machineConfig["effectors"].keys()),
+            "variableValues": [None] * len(machineConfig["variables"]),
+            "variableTargets": [None] * len(machineConfig["variables"]),
+            "measurerValues": [None] * len(machineConfig["measurers"]),
+            "effectorValues": effectorOutput.values,
+            "effectorStates": [None] * len(machineConfig["effectors"]),
+            "variableHistory": [RingBuffer(historyCapacity) for x in machineConfig["variables"]],
+            "measurerHistory": [RingBuffer(historyCapacity) for x in machineConfig["measurers"]]}
+
+
+def startStage(processData, machineConfig, stageData, deviceDrivers):
+    stageConfig = machineConfig
+    if "overrides" in stageData:
+        stageConfig = overlayOverrides(machineConfig, stageData["overrides"], stageData["name"] + " override: ")
+    compiledStage = compileStage(stageConfig, stageData, deviceDrivers)
+    for variableIndex, variableTarget in compiledStage.variableTargets:
+        processData["variableTargets"][variableIndex] = variableTarget
+    stageSetup(processData, compiledStage)
+    return compiledStage
 
 
-def processStep(processData, stageConfig, stageData, deviceDrivers):
-    timers = processData["timers"]
-    variableData = processData["variableData"]
-    measurerData = processData["measurerData"]
-    nextTime = min(timers.keys())
-    currentTime = time.perf_counter_ns() // 1000000
-    if nextTime > currentTime:
-        time.sleep((nextTime - currentTime) / 1000)
-    nextStep = timers.pop(nextTime)
+def processStep(processData, compiledStage):
+    scheduler = processData["scheduler"]
+    variableValues = processData["variableValues"]
+    variableTargets = processData["variableTargets"]
+    measurerValues = processData["measurerValues"]
+    effectorOutput = processData["effectorOutput"]
+    nextTime = scheduler.peekTime()
+    currentTime = processData["clock"].sleepUntilMS(nextTime, processData["stopEvent"])
+    if currentTime < nextTime:
+        return False, processData
+    instrumentation = processData["instrumentation"]
+    if instrumentation is not None:
+        tickStart = time.perf_counter_ns()
+    processData["tickLag"] = currentTime - nextTime
+    processData["stepTime"] = currentTime
+    nextTime, nextStep = scheduler.popNext()
+    measurers = compiledStage.measurers
+    variables = compiledStage.variables
+    effectors = compiledStage.effectors
+    driverExecutor = processData["driverExecutor"]
     measurersToProcess = []
-    variablesToProcess = []
+    variablesToProcess = set()
     effectorsToProcess = []
+    effectorsToRelease = []
     endAfter = False
+    holdDue = False
     for item in nextStep:
         if item[0] == "measurers":
-            measurersToProcess.append(item[1])
+            measurer = measurers[item[1]]
+            measurersToProcess.append(measurer)
+            variablesToProcess.add(measurer.variableIndex)
+            scheduler.schedule(nextTime + measurer.iterateMS, item)
         elif item[0] == "effectors":
-            effectorsToProcess.append(item[1])
+            effectorsToProcess.append(effectors[item[1]])
+        elif item[0] == "release":
+            effectorsToRelease.append(effectors[item[1]])
         elif item[0] == "end":
             endAfter = True
+        elif item[0] == "hold":
+            holdDue = True
+    if driverExecutor is not None and measurersToProcess:
+        for measurer, value in zip(measurersToProcess, driverExecutor.readMeasurers(measurersToProcess)):
+            measurerValues[measurer.index] = value
+    elif compiledStage.bulkReads and measurersToProcess:
+        for measurer, value in zip(measurersToProcess, readMeasurers(measurersToProcess)):
+            measurerValues[measurer.index] = value
+    else:
+        for measurer in measurersToProcess:
+            measurerValues[measurer.index] = measurer.driver()
+    eventStream = processData["eventStream"]
+    measurerHistory = processData["measurerHistory"]
     for measurer in measurersToProcess:
-        measurerData[measurer]["value"] = deviceDrivers[stageConfig["measurers"][measurer]["driverKey"]]()
-        variablesToProcess.append(stageConfig["measurers"][measurer]["variable"])
-        newMeasurerTime = nextTime + stageConfig["measurers"][measurer]["remeasureMS"]
-        if newMeasurerTime not in timers:
-            timers[newMeasurerTime] = []
-        timers[newMeasurerTime].append(["measurers", measurer])
-    variablesToProcess = list(set(variablesToProcess))
-    for variable in variablesToProcess:
-        variableValues = []
-        for measurer in variableData[variable]["measurers"]:
-            if measurerData[measurer]["value"] is not None:
-                variableValues.append(measurerData[measurer]["value"])
-        if len(variableValues) == 1:
-            variableData[variable]["value"] = variableValues[0]
-        else:
-            if stageConfig["variables"][variable]["sensorMixing"] == "min":
-                variableData[variable]["value"] = min(variableValues)
-            elif stageConfig["variables"][variable]["sensorMixing"] == "max":
-                variableData[variable]["value"] = max(variableValues)
-            elif stageConfig["variables"][variable]["sensorMixing"] == "avg":
-                variableData[variable]["value"] = sum(variableValues) / len(variableValues)
+        measurerValue = measurerValues[measurer.index]
+        if measurerValue is not None:
+            measurerHistory[measurer.index].append(currentTime, measurerValue)
+        if eventStream is not None:
+            eventStream.measurement(measurer.index, currentTime, measurerValue)
+        variables[measurer.variableIndex].update(measurer.mixingSlot, measurerValue)
+    variableHistory = processData["variableHistory"]
+    endWatcher = compiledStage.endWatcher
+    safetyTrip = None
+    for variableIndex in variablesToProcess:
+        variable = variables[variableIndex]
+        variableValue = variable.mix()
+        if variableValue is None:
+            continue
+        variableValues[variableIndex] = variableValue
+        variableHistory[variableIndex].append(currentTime, variableValue)
+        if eventStream is not None:
+            eventStream.variable(variableIndex, currentTime, variableValue)
+        if endWatcher is not None:
+            endWatcher.update(variableIndex, variableValue)
+        if variable.checkSafe and safetyTrip is None and \
+                (variableValue < variable.safeLow or variableValue > variable.safeHigh):
+            safetyTrip = (variableIndex, variableValue)
+    if safetyTrip is not None:
+        processData["safetyTrip"] = safetyTrip
+        shutdownEffectors(processData, compiledStage)
+        effectorsToProcess = []
+        effectorsToRelease = []
+        endAfter = True
     for effector in effectorsToProcess:
-        effectorData = stageConfig["effectors"][effector]
-        effectorVariableValue = variableData[effectorData["controlVariable"]]["value"]
-        effectorOut = 0
-        if effectorData["controlType"] == "binary":
-            if effectorVariableValue > effectorData["controlData"]:
-                effectorOut = 1
-            else:
-                effectorOut = 0
-        elif effectorData["controlType"] == "binaryInverted":
-            if effectorVariableValue > effectorData["controlData"]:
-                effectorOut = 0
-            else:
-                effectorOut = 1
-        deviceDrivers[effectorData["driverKey"]](effectorOut)
-        newEffectorTime = nextTime + effectorData["readjustMS"]
-        if newEffectorTime not in timers:
-            timers[newEffectorTime] = []
-        timers[newEffectorTime].append(["effectors", effector])
-    if stageData["stageControl"] == "target":
-        targetPassed = True
-        for variable, target in stageData["controlData"].items():
-            variableValue = variableData[variable]["value"]
-            if target[0] == "above":
-                if variableValue < target[1]:
-                    targetPassed = False
-            elif target[0] == "below":
-                if variableValue > target[1]:
-                    targetPassed = False
-        if targetPassed:
+        effectorVariableValue = variableValues[effector.variableIndex]
+        if effectorVariableValue is None:
+            effectorOut = effector.shutdownSetting
+        else:
+            effectorOut = effector.controller(effector, effectorVariableValue, variableTargets[effector.variableIndex],
+                                              currentTime)
+        effectorOutput.write(effector, effectorOut, currentTime, scheduler)
+        scheduler.schedule(nextTime + effector.iterateMS, ("effectors", effector.index))
+    for effector in effectorsToRelease:
+        effectorOutput.release(effector, currentTime, scheduler)
+    effectorOutput.flush()
+    if endWatcher is not None:
+        if endWatcher.changed and endWatcher.evaluate(currentTime, scheduler):
+            endAfter = True
+        if holdDue and endWatcher.met:
             endAfter = True
+    if eventStream is not None:
+        eventStream.endTick(currentTime)
+    if processData["sharedState"] is not None:
+        processData["sharedState"].publishTick(processData, currentTime, measurersToProcess, variablesToProcess,
+                                               compiledStage.effectors if safetyTrip else
+                                               effectorsToProcess + effectorsToRelease)
+    if instrumentation is not None:
+        instrumentation.recordTick(tickStart, processData["tickLag"])
     return endAfter, processData
 
 
-def stageSetup(processData, stageConfig, stageData, deviceDrivers):
-    newTimers = {}
-    processedMeasurers = []
-    processedEffectors = []
+def shutdownEffectors(processData, compiledStage):
+    effectorOutput = processData["effectorOutput"]
+    for effector in compiledStage.effectors:
+        effectorOutput.force(effector, effector.shutdownSetting, processData["stepTime"])
+    effectorOutput.flush()
+
+
+def stageSetup(processData, compiledStage):
+    processedMeasurers = set()
+    processedEffectors = set()
     stepTime = processData["stepTime"]
-    timers = processData["timers"]
-    variableData = processData["variableData"]
-    measurerData = processData["measurerData"]
-    if "recalculateTimers" in stageData:
-        if stageData["recalculateTimers"]:
-            timers = {}
-    for scheduledTime, scheduledEvents in timers.items():
-        for scheduledEvent in scheduledEvents:
-            if stageConfig[scheduledEvent[0]][scheduledEvent[1]]["active"]:
-                if scheduledTime not in newTimers:
-                    newTimers[scheduledTime] = []
-                newTimers[scheduledTime].append(scheduledEvent)
-                if scheduledEvent[0] == "measurers":
-                    processedMeasurers.append(scheduledEvent[1])
-                elif scheduledEvent[0] == "effectors":
-                    processedEffectors.append(scheduledEvent[1])
-
-    for measurerName, measurerData in stageConfig["measurers"].items():
-        startingTime = stepTime
-        if "offsetMS" in measurerData:
-            startingTime += measurerData["offsetMS"]
-        if measurerData["active"]:
-            variableData[measurerData["variable"]]["measurers"].append(measurerName)
-            if measurerName not in processedMeasurers:
-                if startingTime not in newTimers:
-                    newTimers[startingTime] = []
-                newTimers[startingTime].append(["measurers", measurerName])
-    for effectorName, effectorData in stageConfig["effectors"].items():
-        startingTime = stepTime
-        if "offsetMS" in effectorData:
-            startingTime += effectorData["offsetMS"]
-        if effectorData["controlType"] == "static":
-            try:
-                staticValue = stageData["effectorSettings"][effectorName]
-            except KeyError:
-                staticValue = effectorData["shutdownSetting"]
-            deviceDrivers[effectorData["driverKey"]](staticValue)
-        elif effectorData["active"]:
-            if effectorName not in processedEffectors:
-                if startingTime not in newTimers:
-                    newTimers[startingTime] = []
-                newTimers[startingTime].append(["effectors", effectorName])
+    scheduler = processData["scheduler"]
+    if compiledStage.recalculateTimers:
+        scheduler.clear()
+    for scheduledTime, scheduledEvent in scheduler.events():
+        if scheduledEvent[0] == "measurers" and compiledStage.measurers[scheduledEvent[1]].active:
+            processedMeasurers.add(scheduledEvent[1])
+        elif scheduledEvent[0] == "effectors" and compiledStage.effectors[scheduledEvent[1]].scheduled:
+            processedEffectors.add(scheduledEvent[1])
         else:
-            deviceDrivers[effectorData["driverKey"]](effectorData["shutdownSetting"])
-
-    if stageData["stageControl"] == "time":
-        stageEndTime = stepTime + stageData["controlData"]
-        if stageEndTime not in newTimers:
-            newTimers[stageEndTime] = []
-        newTimers[stageEndTime].append(["end"])
-    for variable in variableData.values():
-        variable["measurers"] = list(set(variable["measurers"]))
-    processData["timers"] = newTimers
+            scheduler.cancel(scheduledEvent)
+
+    effectorOutput = processData["effectorOutput"]
+    effectorOutput.clearPending()
+    measurerValues = processData["measurerValues"]
+    for variable in compiledStage.variables:
+        for slot, measurerIndex in enumerate(variable.measurerIndices):
+            variable.update(slot, measurerValues[measurerIndex])
+    effectorStates = processData["effectorStates"]
+    for effector in compiledStage.effectors:
+        if effector.controlType == "PID":
+            if effectorStates[effector.index] is None:
+                effectorStates[effector.index] = PIDState()
+            effector.state = effectorStates[effector.index]
+            effector.state.setGains(*effector.controlData)
+
+    for measurer in compiledStage.measurers:
+        if measurer.active and measurer.index not in processedMeasurers:
+            scheduler.schedule(stepTime + measurer.offsetMS, ("measurers", measurer.index))
+    for effector in compiledStage.effectors:
+        if effector.setupValue is not None:
+            effectorOutput.force(effector, effector.setupValue, stepTime)
+        elif effector.index not in processedEffectors:
+            scheduler.schedule(stepTime + effector.offsetMS, ("effectors", effector.index))
+    effectorOutput.flush()
+
+    if compiledStage.endTimer is not None:
+        scheduler.schedule(stepTime + compiledStage.endTimer, ("end",))
+    if compiledStage.endWatcher is not None:
+        compiledStage.endWatcher.prime(processData["variableValues"])
     return processData
 
 
@@ -193,6 +345,6 @@ if __name__ == "__main__":
     fakeMachineConfig = json.loads(open("fakeMachineConfig.json").read())
     fakeProcessConfig = json.loads(open("fakeProcessConfig.json").read())
     newQueue = queue.SimpleQueue()
-    runMachineProcess(fakeMachineConfig, fakeProcessConfig, deviceDrivers, newQueue)
+    runMachineProcess(fakeMachineConfig, fakeProcessConfig, loadDriverRegistry("fakeDrivers.json"), newQueue)
     while not newQueue.empty():
         print(newQueue.get())
@@ -0,0 +1,213 @@
+import asyncio
+import fnmatch
+import json
+import threading
+
+from eventStream import EventStreamReader
+
+
+class TelemetryException(Exception):
+    pass
+
+
+def commandError(command):
+    if type(command).__name__ != "dict":
+        return "Command must be a JSON object"
+    for key in ("subscribe", "unsubscribe"):
+        if key in command:
+            patterns = command[key]
+            if type(patterns).__name__ != "list" or any(type(x).__name__ != "str" for x in patterns):
+                return key + " must be a list of strings"
+    if "rateMS" in command:
+        rateMS = command["rateMS"]
+        if type(rateMS).__name__ not in ("int", "float") or not 0 <= rateMS <= 3600000:
+            return "rateMS must be a number between 0 and 3600000"
+    for key in ("snapshot", "stats"):
+        if key in command and type(command[key]).__name__ != "bool":
+            return key + " must be true or false"
+    return None
+
+
+class TelemetryClient:
+    def __init__(self, writer, flushMS):
+        self.writer = writer
+        self.flushMS = flushMS
+        self.subscriptions = set()
+        self.matchCache = {}
+        self.pending = {}
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        self.sent = 0
+
+    def subscribe(self, patterns):
+        self.subscriptions.update(patterns)
+        self.matchCache = {}
+
+    def unsubscribe(self, patterns):
+        self.subscriptions.difference_update(patterns)
+        self.matchCache = {}
+        for channel in list(self.pending):
+            if not self.matches(channel):
+                del self.pending[channel]
+
+    def matches(self, channel):
+        if channel not in self.matchCache:
+            self.matchCache[channel] = any(fnmatch.fnmatchcase(channel, x) for x in self.subscriptions)
+        return self.matchCache[channel]
+
+    def offer(self, channel, update):
+        if not self.matches(channel):
+            return
+        if channel in self.pending:
+            self.dropped += 1
+        self.pending[channel] = update
+        self.wakeup.set()
+
+
+class TelemetryServer:
+    def __init__(self, host="127.0.0.1", port=0, path=None, flushMS=50, maxBufferBytes=65536):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.flushMS = flushMS
+        self.maxBufferBytes = maxBufferBytes
+        self.snapshot = {}
+        self.clients = set()
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.ready = threading.Event()
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        if self.path is not None:
+            self.server = await asyncio.start_unix_server(self.handleClient, path=self.path)
+        else:
+            self.server = await asyncio.start_server(self.handleClient, self.host, self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def start(self):
+        self.thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="telemetryServer", daemon=True)
+        self.thread.start()
+        if not self.ready.wait(5):
+            raise TelemetryException("Telemetry server failed to start")
+        return self.address()
+
+    def stop(self):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.server.close)
+        for client in list(self.clients):
+            self.loop.call_soon_threadsafe(client.writer.close)
+        if self.thread is not None:
+            self.thread.join(5)
+            if self.thread.is_alive():
+                raise TelemetryException("Telemetry server failed to stop")
+            self.thread = None
+        self.loop = None
+        self.ready.clear()
+
+    def address(self):
+        if self.path is not None:
+            return self.path
+        return self.host, self.port
+
+    def publish(self, machineName, updates):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.dispatch, machineName, updates)
+
+    def dispatch(self, machineName, updates):
+        for channelName, eventTime, value in updates:
+            channel = machineName + "." + channelName
+            update = [eventTime, value]
+            self.snapshot[channel] = update
+            for client in self.clients:
+                client.offer(channel, update)
+
+    def eventSink(self, machineName):
+        reader = EventStreamReader()
+        channelKinds = {"measurement": "measurer.", "variable": "variable.", "effector": "effector."}
+
+        def sink(frame):
+            updates = []
+            for eventName, channel, eventTime, value in reader.read(frame):
+                if eventName in channelKinds:
+                    updates.append((channelKinds[eventName] + channel, eventTime, value))
+                else:
+                    updates.append((eventName, eventTime, channel))
+            if updates:
+                self.publish(machineName, updates)
+        return sink
+
+    def sendMessage(self, client, message):
+        client.writer.write(json.dumps(message).encode() + b"\n")
+
+    def sendSnapshot(self, client):
+        values = {x: y for x, y in self.snapshot.items() if client.matches(x)}
+        self.sendMessage(client, {"type": "snapshot", "values": values})
+
+    async def handleClient(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=self.maxBufferBytes)
+        client = TelemetryClient(writer, self.flushMS)
+        self.clients.add(client)
+        writerTask = asyncio.create_task(self.writeUpdates(client))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    command = json.loads(line)
+                except ValueError:
+                    command = None
+                    error = "Invalid JSON"
+                else:
+                    error = commandError(command)
+                if error is None:
+                    self.handleCommand(client, command)
+                else:
+                    self.sendMessage(client, {"type": "error", "message": error})
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writerTask.cancel()
+            writer.close()
+
+    def handleCommand(self, client, command):
+        if "subscribe" in command:
+            client.subscribe(command["subscribe"])
+            self.sendSnapshot(client)
+        if "unsubscribe" in command:
+            client.unsubscribe(command["unsubscribe"])
+        if "rateMS" in command:
+            client.flushMS = int(command["rateMS"])
+        if command.get("snapshot"):
+            self.sendSnapshot(client)
+        if command.get("stats"):
+            self.sendMessage(client, {"type": "stats", "sent": client.sent, "dropped": client.dropped,
+                                      "subscriptions": sorted(client.subscriptions)})
+
+    async def writeUpdates(self, client):
+        try:
+            while True:
+                await client.wakeup.wait()
+                client.wakeup.clear()
+                values = client.pending
+                client.pending = {}
+                if values:
+                    self.sendMessage(client, {"type": "update", "values": values})
+                    client.sent += len(values)
+                    await client.writer.drain()
+                if client.flushMS:
+                    await asyncio.sleep(client.flushMS / 1000)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
@@ -0,0 +1,138 @@
+import json
+import os
+import queue
+import threading
+
+from configValidator import configHash
+from stageCompiler import PIDState
+
+checkpointVersion = 2
+transientEvents = ["release", "hold"]
+
+
+class CheckpointException(Exception):
+    pass
+
+
+def relativeTime(eventTime, stepTime):
+    if eventTime is None:
+        return None
+    return eventTime - stepTime
+
+
+def takeSnapshot(processData, stageCounter, stageStartTime):
+    stepTime = processData["stepTime"]
+    effectorStates = []
+    for state in processData["effectorStates"]:
+        if state is None:
+            effectorStates.append(None)
+        else:
+            effectorStates.append([state.integral, state.previousError, relativeTime(state.lastTime, stepTime)])
+    return {"version": checkpointVersion, "wallTimeMS": processData["clock"].wallTimeMS(), "stage": stageCounter,
+            "stageElapsedMS": stepTime - stageStartTime,
+            "events": [(x[0] - stepTime, x[1]) for x in processData["scheduler"].activeEvents()
+                       if x[1][0] not in transientEvents],
+            "variableValues": list(processData["variableValues"]),
+            "measurerValues": list(processData["measurerValues"]),
+            "effectorWriteTimes": [relativeTime(x, stepTime) for x in processData["effectorOutput"].writeTimes],
+            "effectorStates": effectorStates}
+
+
+class CheckpointWriter:
+    def __init__(self, path, intervalMS, configKey):
+        self.path = path
+        self.intervalMS = intervalMS
+        self.configKey = configKey
+        self.nextTime = None
+        self.written = 0
+        self.error = None
+        self.snapshots = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name="checkpointWriter", daemon=True)
+        self.thread.start()
+
+    def due(self, stepTime):
+        return self.nextTime is None or stepTime >= self.nextTime
+
+    def checkpoint(self, processData, stageCounter, stageStartTime):
+        self.nextTime = processData["stepTime"] + self.intervalMS
+        self.snapshots.put(takeSnapshot(processData, stageCounter, stageStartTime))
+
+    def run(self):
+        while True:
+            snapshot = self.snapshots.get()
+            while snapshot is not None and not self.snapshots.empty():
+                newer = self.snapshots.get()
+                if newer is None:
+                    self.writeSnapshot(snapshot)
+                snapshot = newer
+            if snapshot is None:
+                return
+            self.writeSnapshot(snapshot)
+
+    def writeSnapshot(self, snapshot):
+        try:
+            snapshot["config"] = self.configKey
+            temporaryPath = self.path + ".tmp"
+            with open(temporaryPath, "w") as checkpointFile:
+                checkpointFile.write(json.dumps(snapshot, separators=(",", ":")))
+                checkpointFile.flush()
+                os.fsync(checkpointFile.fileno())
+            os.replace(temporaryPath, self.path)
+            self.written += 1
+        except OSError as e:
+            self.error = e
+
+    def close(self, discard=False):
+        self.snapshots.put(None)
+        self.thread.join()
+        if discard and os.path.exists(self.path):
+            os.remove(self.path)
+        if self.error is not None:
+            raise CheckpointException("Checkpoint writer failed: " + repr(self.error))
+
+
+def checkpointKey(machineConfig, processConfig, deviceDrivers):
+    return configHash(machineConfig, processConfig, deviceDrivers)
+
+
+def loadCheckpoint(path, configKey):
+    if not os.path.exists(path):
+        return None
+    try:
+        checkpoint = json.loads(open(path).read())
+    except ValueError as e:
+        raise CheckpointException("Checkpoint " + path + " is unreadable: " + str(e))
+    if checkpoint.get("version") != checkpointVersion:
+        raise CheckpointException("Unsupported checkpoint version " + str(checkpoint.get("version")))
+    if checkpoint.get("config") != configKey:
+        raise CheckpointException("Checkpoint " + path + " was written for a different machine or process config")
+    return checkpoint
+
+
+def restoreCheckpoint(processData, checkpoint, downtimeMS=None):
+    stepTime = processData["stepTime"]
+    if downtimeMS is None:
+        downtimeMS = max(0, processData["clock"].wallTimeMS() - checkpoint["wallTimeMS"])
+    processData["variableValues"][:] = checkpoint["variableValues"]
+    processData["measurerValues"][:] = checkpoint["measurerValues"]
+    writeTimes = processData["effectorOutput"].writeTimes
+    for effectorIndex, writeTime in enumerate(checkpoint["effectorWriteTimes"]):
+        if writeTime is not None:
+            writeTimes[effectorIndex] = stepTime + writeTime - downtimeMS
+    for effectorIndex, savedState in enumerate(checkpoint["effectorStates"]):
+        if savedState is None:
+            continue
+        state = PIDState()
+        state.integral, state.previousError, lastTime = savedState
+        if lastTime is not None:
+            state.lastTime = stepTime + lastTime
+        processData["effectorStates"][effectorIndex] = state
+    return stepTime - checkpoint["stageElapsedMS"]
+
+
+def rebaseSchedule(processData, checkpoint):
+    scheduler = processData["scheduler"]
+    stepTime = processData["stepTime"]
+    scheduler.clear()
+    for offset, event in checkpoint["events"]:
+        scheduler.schedule(stepTime + max(0, offset), tuple(event))
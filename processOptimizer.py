@@ -0,0 +1,230 @@
+import concurrent.futures
+import copy
+import json
+import math
+import os
+
+from configValidator import configHash, validateFullConfig
+from eventStream import decodeFrame, FRAME_CHANNELS, EVENT_STAGE, EVENT_VARIABLE, EVENT_SHUTDOWN
+from fakeMachine import buildTestMachine
+from fakeMachineBatch import expandParameterGrid
+from fakeMachineDriver import buildFakeDeviceDrivers
+from fakeMachineSimulator import simulateProcess
+from machineClock import VirtualClock
+
+optimizerVersion = 2
+objectives = ["time", "overshoot"]
+
+
+class OptimizerException(Exception):
+    pass
+
+
+def parameterRange(low, high, step):
+    values = []
+    value = low
+    while value <= high:
+        values.append(value)
+        value += step
+    return values
+
+
+def applyParameters(processConfig, parameters):
+    candidateConfig = copy.deepcopy(processConfig)
+    for parameterPath, value in parameters.items():
+        keys = parameterPath.split(".")
+        section = candidateConfig
+        for key in keys[:-1]:
+            section = section.setdefault(key, {})
+            if type(section).__name__ != "dict":
+                raise OptimizerException("Parameter " + parameterPath + " does not address a config section")
+        section[keys[-1]] = value
+    return candidateConfig
+
+
+class OvershootTracker:
+    def __init__(self, processConfig):
+        self.processConfig = processConfig
+        self.variableNames = []
+        self.targets = {}
+        self.startBelow = {}
+        self.reached = set()
+        self.lastValues = {}
+        self.overshoot = 0
+        self.shortfall = 0
+
+    def sink(self, frame):
+        frameType, content = decodeFrame(frame)
+        if frameType == FRAME_CHANNELS:
+            self.variableNames = content["variables"]
+            return
+        for eventType, channel, eventTime, value in content:
+            if eventType in (EVENT_STAGE, EVENT_SHUTDOWN):
+                self.finishStage()
+            if eventType == EVENT_STAGE:
+                self.targets = self.processConfig["stages"].get(str(channel), {}).get("variableTargets", {})
+                self.startBelow = {}
+                self.reached = set()
+                self.lastValues = {}
+            elif eventType == EVENT_VARIABLE and self.variableNames[channel] in self.targets:
+                self.variable(channel, value)
+
+    def finishStage(self):
+        for variableName, target in self.targets.items():
+            if variableName not in self.variableNames or self.variableNames.index(variableName) in self.reached:
+                continue
+            lastValue = self.lastValues.get(self.variableNames.index(variableName))
+            if lastValue is None:
+                self.shortfall = math.inf
+            else:
+                self.shortfall = max(self.shortfall, abs(lastValue - target))
+        self.targets = {}
+
+    def variable(self, channel, value):
+        target = self.targets[self.variableNames[channel]]
+        self.lastValues[channel] = value
+        if channel not in self.reached:
+            below = self.startBelow.setdefault(channel, value < target)
+            if value != target and (value < target) == below:
+                return
+            self.reached.add(channel)
+        self.overshoot = max(self.overshoot, abs(value - target))
+
+
+def evaluateCandidate(machineConfig, processConfig, timeLimitMS, machineFactory=buildTestMachine,
+                      driverFactory=buildFakeDeviceDrivers):
+    tracker = OvershootTracker(processConfig)
+    result = simulateProcess(machineConfig, processConfig, machineFactory, driverFactory, timeLimitMS,
+                             eventSink=tracker.sink)
+    tracker.finishStage()
+    shutdown = result["shutdown"] or ["STOPPED"]
+    stageTimes = [result["stageTimes"][x] for x in sorted(result["stageTimes"])]
+    return {"durationMS": result["durationMS"], "stageTimes": stageTimes, "shutdown": shutdown,
+            "overshoot": round(tracker.overshoot, 3), "shortfall": round(tracker.shortfall, 3),
+            "feasible": shutdown[0] == "PROCESS COMPLETE"}
+
+
+def failedCandidate(reason, message):
+    return {"durationMS": None, "stageTimes": [], "shutdown": [reason, message], "overshoot": None,
+            "shortfall": None, "feasible": False}
+
+
+class SimulationCache:
+    def __init__(self, path=None):
+        self.path = path
+        self.results = {}
+        if path is not None and os.path.exists(path):
+            self.results = json.loads(open(path).read())
+
+    def get(self, key):
+        return self.results.get(key)
+
+    def put(self, key, result):
+        self.results[key] = result
+
+    def save(self):
+        if self.path is None:
+            return
+        temporaryPath = self.path + ".tmp"
+        with open(temporaryPath, "w") as cacheFile:
+            cacheFile.write(json.dumps(self.results))
+        os.replace(temporaryPath, self.path)
+
+
+def factoryName(factory):
+    qualifiedName = getattr(factory, "__qualname__", None)
+    if qualifiedName is None or "<" in qualifiedName or not hasattr(factory, "__module__"):
+        return None
+    return factory.__module__ + ":" + qualifiedName
+
+
+def candidateKey(machineConfig, processConfig, timeLimitMS, factoryKey):
+    return configHash(machineConfig, processConfig, [str(optimizerVersion), str(timeLimitMS), factoryKey])
+
+
+def objectiveKey(objective):
+    if objective == "time":
+        return lambda x: (x["shortfall"], x["durationMS"], x["overshoot"])
+    if objective == "overshoot":
+        return lambda x: (x["shortfall"], x["overshoot"], x["durationMS"])
+    raise OptimizerException("Unknown objective " + str(objective) + ", expected one of " + ", ".join(objectives))
+
+
+def optimizeProcess(machineConfig, processConfig, parameterRanges, objective="time", workers=None,
+                    timeLimitMS=86400000, cache=None, machineFactory=buildTestMachine,
+                    driverFactory=buildFakeDeviceDrivers, factoryKey=None):
+    sortKey = objectiveKey(objective)
+    if factoryKey is None:
+        factoryNames = [factoryName(machineFactory), factoryName(driverFactory)]
+        if None in factoryNames:
+            raise OptimizerException("Machine and driver factories must be named module-level functions, "
+                                     "or a factoryKey must identify them")
+        factoryKey = " ".join(factoryNames)
+    if cache is None:
+        cache = SimulationCache()
+    deviceDrivers = driverFactory(machineFactory(VirtualClock()), None)
+    candidates = {}
+    failed = {}
+    for parameters in expandParameterGrid(parameterRanges):
+        candidateConfig = applyParameters(processConfig, parameters)
+        key = candidateKey(machineConfig, candidateConfig, timeLimitMS, factoryKey)
+        if key in candidates:
+            continue
+        candidates[key] = (parameters, candidateConfig)
+        valid, message = validateFullConfig(machineConfig, candidateConfig, deviceDrivers)
+        if not valid:
+            failed[key] = failedCandidate("VALIDATION ERROR", message)
+    uncached = [x for x in candidates if x not in failed and cache.get(x) is None]
+    cachedCount = len(candidates) - len(failed) - len(uncached)
+    if workers == 0:
+        for key in uncached:
+            try:
+                cache.put(key, evaluateCandidate(machineConfig, candidates[key][1], timeLimitMS, machineFactory,
+                                                 driverFactory))
+            except Exception as e:
+                failed[key] = failedCandidate("SIMULATION ERROR", repr(e))
+    elif uncached:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(evaluateCandidate, machineConfig, candidates[x][1], timeLimitMS,
+                                       machineFactory, driverFactory): x for x in uncached}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    cache.put(futures[future], future.result())
+                except Exception as e:
+                    failed[futures[future]] = failedCandidate("SIMULATION ERROR", repr(e))
+    cache.save()
+    results = []
+    rejected = []
+    for key, (parameters, candidateConfig) in candidates.items():
+        result = dict(failed.get(key) or cache.get(key), parameters=parameters, processConfig=candidateConfig)
+        if result["feasible"]:
+            results.append(result)
+        else:
+            rejected.append(result)
+    results.sort(key=sortKey)
+    return {"results": results, "rejected": rejected, "simulated": len(uncached),
+            "cached": cachedCount}
+
+
+if __name__ == "__main__":
+    fakeMachineConfig = json.loads(open("fakeMachineConfig.json").read())
+    fakeProcessConfig = json.loads(open("fakeProcessConfig.json").read())
+    controllerPath = "overrides.effectors.temperatureController1."
+    searchRanges = {
+        controllerPath + "controlType": ["binaryInverted"],
+        controllerPath + "minChangeDelayMS": [0, 200],
+        controllerPath + "iterateMS": [100, 200],
+        controllerPath + "controlBinaryThreshold": parameterRange(45, 55, 5),
+        "overrides.measurers.temperatureProbe1.iterateMS": [100, 200],
+        "stages.0.stageEndTarget.temperature": [["above", 45], ["above", 50]],
+        "stages.1.stageEndTimer": [5000, 10000]
+    }
+    searchCache = SimulationCache()
+    for searchObjective in objectives:
+        search = optimizeProcess(fakeMachineConfig, fakeProcessConfig, searchRanges, searchObjective,
+                                 timeLimitMS=600000, cache=searchCache)
+        print(searchObjective, "simulated", search["simulated"], "cached", search["cached"], "rejected",
+              len(search["rejected"]))
+        for searchResult in search["results"][:3]:
+            print(searchResult["durationMS"], searchResult["overshoot"], searchResult["shortfall"],
+                  searchResult["parameters"])
@@ -0,0 +1,128 @@
+import json
+import math
+import sys
+
+import numpy as np
+
+from eventStream import EVENT_MEASUREMENT
+from machineClock import VirtualClock
+from machineEngine import runMachineProcess
+from fakeMachineSimulator import ClockedQueue, ClockLimit, summarizeMessages
+from runReader import RunStream
+
+
+class ReplayException(Exception):
+    pass
+
+
+class ReplayTrace:
+    def __init__(self, path, clock):
+        self.stream = RunStream(path)
+        self.clock = clock
+        self.measurerNames = self.stream.channels.get("measurers", [])
+        self.measurerValues = [None] * len(self.measurerNames)
+        self.measurerTimes = [None] * len(self.measurerNames)
+        self.recordStart, self.recordEnd = self.stream.timeRange()
+        if self.recordStart is None:
+            raise ReplayException(path + " contains no recorded events")
+        self.replayStart = clock.nowMS()
+        self.chunks = self.stream.chunks()
+        self.chunk = None
+        self.position = 0
+        self.commands = []
+
+    def durationMS(self):
+        return self.recordEnd - self.recordStart
+
+    def recordTime(self):
+        return self.recordStart + self.clock.nowMS() - self.replayStart
+
+    def advance(self, recordTime):
+        while True:
+            if self.chunk is None:
+                self.chunk = next(self.chunks, None)
+                self.position = 0
+                if self.chunk is None:
+                    return
+            eventTypes, channelIndices, times, values = self.chunk
+            end = int(np.searchsorted(times, recordTime, side="right"))
+            measured = np.flatnonzero(eventTypes[self.position:end] == EVENT_MEASUREMENT) + self.position
+            for channel, eventTime, value in zip(channelIndices[measured].tolist(), times[measured].tolist(),
+                                                 values[measured].tolist()):
+                self.measurerValues[channel] = None if math.isnan(value) else value
+                self.measurerTimes[channel] = eventTime
+            self.position = end
+            if end < len(times):
+                return
+            self.chunk = None
+
+    def measure(self, measurerIndices):
+        self.advance(self.recordTime())
+        latest = max(measurerIndices, key=lambda x: -1 if self.measurerTimes[x] is None else self.measurerTimes[x])
+        return self.measurerValues[latest]
+
+    def close(self):
+        self.chunk = None
+        self.chunks.close()
+        self.stream.close()
+
+
+def buildReplayDrivers(machineConfig, trace, log=print):
+    deviceDrivers = {}
+    driverMeasurers = {}
+    for measurerName, measurerData in machineConfig["measurers"].items():
+        if measurerData["name"] not in trace.measurerNames:
+            raise ReplayException("Measurer " + measurerData["name"] + " is not in the recorded trace")
+        measurerIndex = trace.measurerNames.index(measurerData["name"])
+        channels = driverMeasurers.setdefault(measurerData["driverKey"], {})
+        channels.setdefault(measurerData.get("channel", measurerData["name"]), []).append(measurerIndex)
+    for driverKey, channels in driverMeasurers.items():
+        deviceDrivers[driverKey] = replayMeasurer(trace, channels)
+    for effectorName, effectorData in machineConfig["effectors"].items():
+        deviceDrivers[effectorData["driverKey"]] = replayEffector(trace, effectorData["name"], log)
+    return deviceDrivers
+
+
+def replayMeasurer(trace, channels):
+    measurerIndices = [x for y in channels.values() for x in y]
+
+    def measure():
+        return trace.measure(measurerIndices)
+
+    def readChannels(channelNames):
+        return [trace.measure(channels[x]) for x in channelNames]
+
+    measure.readChannels = readChannels
+    return measure
+
+
+def replayEffector(trace, effectorName, log):
+    def setEffector(x):
+        trace.commands.append((trace.clock.nowMS(), effectorName, x))
+        if log is not None:
+            log(effectorName + ": " + str(x))
+    return setEffector
+
+
+def replayProcess(machineConfig, processConfig, tracePath, timeLimitMS=None, log=None, **engineOptions):
+    clock = VirtualClock()
+    trace = ReplayTrace(tracePath, clock)
+    try:
+        deviceDrivers = buildReplayDrivers(machineConfig, trace, log)
+        if timeLimitMS is None:
+            timeLimitMS = trace.durationMS()
+        messageQueue = ClockedQueue(clock)
+        runMachineProcess(machineConfig, processConfig, deviceDrivers, messageQueue,
+                          stopEvent=ClockLimit(clock, timeLimitMS), clock=clock, **engineOptions)
+    finally:
+        trace.close()
+    stageTimes, shutdown = summarizeMessages(messageQueue.messages)
+    return {"durationMS": clock.nowMS(), "stageTimes": stageTimes, "shutdown": shutdown,
+            "messages": messageQueue.messages, "commands": trace.commands}
+
+
+if __name__ == "__main__":
+    fakeMachineConfig = json.loads(open("fakeMachineConfig.json").read())
+    fakeProcessConfig = json.loads(open("fakeProcessConfig.json").read())
+    result = replayProcess(fakeMachineConfig, fakeProcessConfig, sys.argv[1])
+    print(result["shutdown"], result["durationMS"], result["stageTimes"], len(result["commands"]), "commands")
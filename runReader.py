@@ -0,0 +1,117 @@
+import json
+import mmap
+import sys
+
+import numpy as np
+
+from eventStream import EVENT_STAGE, EVENT_MEASUREMENT, EVENT_VARIABLE, EVENT_EFFECTOR, EVENT_SHUTDOWN, \
+    shutdownReasons
+from runRecorder import fileHeader, fileMagic, recorderVersion, RecorderException, recordingChunks
+
+groupEvents = {"measurers": EVENT_MEASUREMENT, "variables": EVENT_VARIABLE, "effectors": EVENT_EFFECTOR}
+
+
+class RunRecording:
+    def __init__(self, channels, eventTypes, channelIndices, times, values, complete):
+        self.channels = channels
+        self.eventTypes = eventTypes
+        self.channelIndices = channelIndices
+        self.times = times
+        self.values = values
+        self.complete = complete
+
+    def trace(self, group, name):
+        mask = (self.eventTypes == groupEvents[group]) & (self.channelIndices == self.channels[group].index(name))
+        return self.times[mask], self.values[mask]
+
+    def traces(self, group):
+        return {x: self.trace(group, x) for x in self.channels.get(group, [])}
+
+    def stages(self):
+        mask = self.eventTypes == EVENT_STAGE
+        return list(zip(self.channelIndices[mask].tolist(), self.times[mask].tolist()))
+
+    def shutdown(self):
+        positions = np.flatnonzero(self.eventTypes == EVENT_SHUTDOWN)
+        if not len(positions):
+            return None
+        return shutdownReasons[self.channelIndices[positions[-1]]], int(self.times[positions[-1]])
+
+
+def readChunk(buffer, offset, count, baseTime):
+    values = np.frombuffer(buffer, dtype="<f8", count=count, offset=offset)
+    offset += 8 * count
+    timeDeltas = np.frombuffer(buffer, dtype="<i4", count=count, offset=offset)
+    offset += 4 * count
+    channelIndices = np.frombuffer(buffer, dtype="<u2", count=count, offset=offset)
+    offset += 2 * count
+    eventTypes = np.frombuffer(buffer, dtype="u1", count=count, offset=offset)
+    times = baseTime + np.cumsum(timeDeltas, dtype=np.int64)
+    return eventTypes.copy(), channelIndices.copy(), times, values.copy()
+
+
+class RunStream:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.size = self.file.seek(0, 2)
+        if self.size < fileHeader.size:
+            self.file.close()
+            raise RecorderException(path + " is not a run recording")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, reserved, channelsLength = fileHeader.unpack_from(self.buffer, 0)
+        if magic != fileMagic:
+            self.close()
+            raise RecorderException(path + " is not a run recording")
+        if version > recorderVersion:
+            self.close()
+            raise RecorderException("Unsupported recording version " + str(version))
+        self.channels = json.loads(self.buffer[fileHeader.size:fileHeader.size + channelsLength])
+        self.dataOffset = fileHeader.size + channelsLength
+
+    def chunkHeaders(self):
+        for bodyStart, count, baseTime, end in recordingChunks(self.buffer, self.dataOffset, self.size):
+            yield bodyStart, count, baseTime
+
+    def chunks(self):
+        for bodyStart, count, baseTime in self.chunkHeaders():
+            yield readChunk(self.buffer, bodyStart, count, baseTime)
+
+    def timeRange(self):
+        first = None
+        last = None
+        for header in self.chunkHeaders():
+            if first is None:
+                first = header
+            last = header
+        if first is None:
+            return None, None
+        return first[2], int(readChunk(self.buffer, *last)[2][-1])
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+
+def loadRun(path):
+    stream = RunStream(path)
+    try:
+        chunks = list(stream.chunks())
+    finally:
+        stream.close()
+    if chunks:
+        columns = [np.concatenate(x) for x in zip(*chunks)]
+        complete = bool(columns[0][-1] == EVENT_SHUTDOWN)
+    else:
+        columns = [np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint16), np.zeros(0, dtype=np.int64),
+                   np.zeros(0, dtype=np.float64)]
+        complete = False
+    return RunRecording(stream.channels, *columns, complete)
+
+
+if __name__ == "__main__":
+    recording = loadRun(sys.argv[1])
+    print("Stages:", recording.stages(), "Shutdown:", recording.shutdown(), "Complete:", recording.complete)
+    for groupName in groupEvents:
+        for channelName, (traceTimes, traceValues) in recording.traces(groupName).items():
+            print(groupName, channelName, len(traceTimes), "samples", traceValues[-5:].tolist())
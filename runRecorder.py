@@ -0,0 +1,161 @@
+import json
+import mmap
+import os
+import queue
+import struct
+import threading
+import zlib
+from array import array
+
+from eventStream import decodeFrame, FRAME_CHANNELS, EVENT_SHUTDOWN
+
+recorderVersion = 1
+fileMagic = b"YLRR"
+chunkMagic = b"YLRC"
+fileHeader = struct.Struct("<4sHHI")
+chunkHeader = struct.Struct("<4sIqII")
+maxTimeDelta = 2 ** 31 - 1
+
+
+class RecorderException(Exception):
+    pass
+
+
+def recordingChunks(buffer, offset, size):
+    while offset + chunkHeader.size <= size:
+        magic, count, baseTime, bodyLength, checksum = chunkHeader.unpack_from(buffer, offset)
+        bodyStart = offset + chunkHeader.size
+        if magic != chunkMagic or bodyStart + bodyLength > size:
+            return
+        if zlib.crc32(buffer[bodyStart:bodyStart + bodyLength]) != checksum:
+            return
+        yield bodyStart, count, baseTime, bodyStart + bodyLength
+        offset = bodyStart + bodyLength
+
+
+def recordingEnd(buffer, size):
+    magic, version, reserved, channelsLength = fileHeader.unpack_from(buffer, 0)
+    if magic != fileMagic or version != recorderVersion:
+        raise RecorderException("Cannot continue a recording that is not a version " + str(recorderVersion) +
+                                " run recording")
+    offset = fileHeader.size + channelsLength
+    for bodyStart, count, baseTime, offset in recordingChunks(buffer, offset, size):
+        pass
+    return offset
+
+
+class RunRecorder:
+    def __init__(self, path, chunkRecords=4096, flushMS=1000, growBytes=1 << 20, resume=False):
+        self.path = path
+        self.chunkRecords = chunkRecords
+        self.flushMS = flushMS
+        self.growBytes = growBytes
+        self.offset = 0
+        if resume and os.path.exists(path) and os.path.getsize(path) >= fileHeader.size:
+            self.file = open(path, "r+b")
+            with mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) as existing:
+                try:
+                    self.offset = recordingEnd(existing, len(existing))
+                except RecorderException:
+                    self.file.close()
+                    raise
+        else:
+            self.file = open(path, "w+b")
+        self.size = self.offset + growBytes
+        self.file.truncate(self.size)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+        self.chunks = 0
+        self.records = 0
+        self.error = None
+        self.resetColumns()
+        self.frames = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name="runRecorder", daemon=True)
+        self.thread.start()
+
+    def resetColumns(self):
+        self.values = array("d")
+        self.timeDeltas = array("i")
+        self.channels = array("H")
+        self.eventTypes = array("B")
+        self.baseTime = None
+        self.lastTime = None
+
+    def write(self, frame):
+        self.frames.put(frame)
+
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(self.offset)
+        self.file.close()
+        if self.error is not None:
+            raise RecorderException("Run recorder failed: " + repr(self.error))
+
+    def run(self):
+        timeout = self.flushMS / 1000 if self.flushMS else None
+        try:
+            while True:
+                try:
+                    frame = self.frames.get(timeout=timeout)
+                except queue.Empty:
+                    self.writeChunk()
+                    continue
+                if frame is None:
+                    self.writeChunk()
+                    return
+                self.writeFrame(frame)
+        except Exception as e:
+            self.error = e
+
+    def writeFrame(self, frame):
+        frameType, content = decodeFrame(frame)
+        if frameType == FRAME_CHANNELS:
+            if self.offset == 0:
+                self.writeHeader(content)
+            return
+        for eventType, channel, eventTime, value in content:
+            if self.lastTime is not None and abs(eventTime - self.lastTime) > maxTimeDelta:
+                self.writeChunk()
+            if self.baseTime is None:
+                self.baseTime = eventTime
+                self.lastTime = eventTime
+            self.values.append(value)
+            self.timeDeltas.append(eventTime - self.lastTime)
+            self.channels.append(channel)
+            self.eventTypes.append(eventType)
+            self.lastTime = eventTime
+            if len(self.values) >= self.chunkRecords or eventType == EVENT_SHUTDOWN:
+                self.writeChunk()
+
+    def writeHeader(self, channels):
+        payload = json.dumps(channels).encode()
+        payload += b" " * (-(fileHeader.size + len(payload)) % 8)
+        self.append(fileHeader.pack(fileMagic, recorderVersion, 0, len(payload)) + payload)
+
+    def writeChunk(self):
+        count = len(self.values)
+        if count == 0:
+            return
+        if self.offset == 0:
+            self.writeHeader({})
+        body = self.values.tobytes() + self.timeDeltas.tobytes() + self.channels.tobytes() + self.eventTypes.tobytes()
+        body += bytes(-len(body) % 8)
+        self.append(chunkHeader.pack(chunkMagic, count, self.baseTime, len(body), zlib.crc32(body)) + body)
+        self.chunks += 1
+        self.records += count
+        self.resetColumns()
+
+    def append(self, data):
+        if self.offset + len(data) > self.size:
+            self.map.flush()
+            self.map.close()
+            self.size += max(self.growBytes, len(data))
+            self.file.truncate(self.size)
+            self.map = mmap.mmap(self.file.fileno(), self.size)
+        start = self.offset
+        self.map[start:start + len(data)] = data
+        self.offset += len(data)
+        pageStart = start - start % mmap.PAGESIZE
+        self.map.flush(pageStart, self.offset - pageStart)
@@ -0,0 +1,151 @@
+import json
+import math
+import os
+import struct
+from multiprocessing import shared_memory, resource_tracker
+
+sharedStateMagic = b"YLSS"
+sharedStateVersion = 1
+sharedStateHeader = struct.Struct("<4sHHIIII")
+sequenceOffset = 24
+stageOffset = 32
+updateTimeOffset = 40
+arraysOffset = 48
+publishedBlocks = set()
+
+
+class SharedStateException(Exception):
+    pass
+
+
+def sharedStateLayout(variableCount, measurerCount, effectorCount):
+    layout = {}
+    offset = arraysOffset
+    for group, count in [("variables", variableCount), ("measurers", measurerCount), ("effectors", effectorCount)]:
+        layout[group] = (offset, offset + 8 * count, count)
+        offset += 16 * count
+    layout["names"] = offset
+    return layout
+
+
+def mapArrays(buffer, layout):
+    arrays = {}
+    for group in ["variables", "measurers", "effectors"]:
+        timeOffset, valueOffset, count = layout[group]
+        arrays[group] = (buffer[timeOffset:timeOffset + 8 * count].cast("q"),
+                         buffer[valueOffset:valueOffset + 8 * count].cast("d"))
+    return arrays
+
+
+def untrackBlock(name):
+    if name not in publishedBlocks and os.name == "posix":
+        resource_tracker.unregister("/" + name, "shared_memory")
+
+
+class SharedStatePublisher:
+    def __init__(self, processData, name=None):
+        names = {"variables": processData["variableNames"], "measurers": processData["measurerNames"],
+                 "effectors": processData["effectorNames"]}
+        namesPayload = json.dumps(names).encode()
+        counts = [len(names["variables"]), len(names["measurers"]), len(names["effectors"])]
+        self.layout = sharedStateLayout(*counts)
+        self.memory = shared_memory.SharedMemory(name=name, create=True, size=self.layout["names"] + len(namesPayload))
+        self.name = self.memory.name
+        publishedBlocks.add(self.name)
+        buffer = self.memory.buf
+        sharedStateHeader.pack_into(buffer, 0, sharedStateMagic, sharedStateVersion, 0, *counts, len(namesPayload))
+        buffer[self.layout["names"]:self.layout["names"] + len(namesPayload)] = namesPayload
+        self.sequence = buffer[sequenceOffset:sequenceOffset + 8].cast("Q")
+        self.stage = buffer[stageOffset:stageOffset + 8].cast("q")
+        self.updateTime = buffer[updateTimeOffset:updateTimeOffset + 8].cast("q")
+        self.arrays = mapArrays(buffer, self.layout)
+        self.sequence[0] = 0
+        self.stage[0] = -1
+        for timestamps, values in self.arrays.values():
+            for index in range(len(values)):
+                timestamps[index] = -1
+                values[index] = math.nan
+
+    def writeValue(self, group, index, timestamp, value):
+        timestamps, values = self.arrays[group]
+        timestamps[index] = timestamp
+        values[index] = math.nan if value is None else value
+
+    def publishTick(self, processData, currentTime, measurers, variableIndices, effectors):
+        self.sequence[0] += 1
+        measurerValues = processData["measurerValues"]
+        for measurer in measurers:
+            self.writeValue("measurers", measurer.index, currentTime, measurerValues[measurer.index])
+        variableValues = processData["variableValues"]
+        for variableIndex in variableIndices:
+            self.writeValue("variables", variableIndex, currentTime, variableValues[variableIndex])
+        effectorValues = processData["effectorValues"]
+        for effector in effectors:
+            self.writeValue("effectors", effector.index, currentTime, effectorValues[effector.index])
+        self.updateTime[0] = currentTime
+        self.sequence[0] += 1
+
+    def publishAll(self, processData, stage, currentTime):
+        self.sequence[0] += 1
+        self.stage[0] = stage
+        for group, valueKey in [("variables", "variableValues"), ("measurers", "measurerValues"),
+                                ("effectors", "effectorValues")]:
+            for index, value in enumerate(processData[valueKey]):
+                if value is not None:
+                    self.writeValue(group, index, currentTime, value)
+        self.updateTime[0] = currentTime
+        self.sequence[0] += 1
+
+    def close(self, unlink=True):
+        self.sequence.release()
+        self.stage.release()
+        self.updateTime.release()
+        for timestamps, values in self.arrays.values():
+            timestamps.release()
+            values.release()
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+        publishedBlocks.discard(self.name)
+
+
+class SharedStateReader:
+    def __init__(self, name):
+        self.memory = shared_memory.SharedMemory(name=name)
+        untrackBlock(self.memory.name)
+        buffer = self.memory.buf
+        magic, version, padding, variableCount, measurerCount, effectorCount, namesLength = \
+            sharedStateHeader.unpack_from(buffer, 0)
+        if magic != sharedStateMagic:
+            raise SharedStateException("Shared memory block " + name + " is not a machine state block")
+        if version > sharedStateVersion:
+            raise SharedStateException("Unsupported shared state version " + str(version))
+        self.layout = sharedStateLayout(variableCount, measurerCount, effectorCount)
+        self.names = json.loads(bytes(buffer[self.layout["names"]:self.layout["names"] + namesLength]))
+        self.sequence = buffer[sequenceOffset:sequenceOffset + 8].cast("Q")
+        self.stage = buffer[stageOffset:stageOffset + 8].cast("q")
+        self.updateTime = buffer[updateTimeOffset:updateTimeOffset + 8].cast("q")
+        self.arrays = mapArrays(buffer, self.layout)
+
+    def read(self, retries=1000):
+        for attempt in range(retries):
+            sequence = self.sequence[0]
+            if sequence % 2:
+                continue
+            snapshot = {"sequence": sequence, "stage": self.stage[0], "updateTime": self.updateTime[0]}
+            for group, (timestamps, values) in self.arrays.items():
+                snapshot[group] = {name: (timestamp, None if math.isnan(value) else value)
+                                   for name, timestamp, value in zip(self.names[group], timestamps.tolist(),
+                                                                     values.tolist())}
+            if self.sequence[0] == sequence:
+                return snapshot
+        raise SharedStateException("Could not read a consistent snapshot")
+
+    def close(self):
+        self.sequence.release()
+        self.stage.release()
+        self.updateTime.release()
+        for timestamps, values in self.arrays.values():
+            timestamps.release()
+            values.release()
+        self.memory.close()
@@ -0,0 +1,393 @@
+import asyncio
+import bisect
+import inspect
+import math
+import operator
+
+
+def validValues(variable):
+    return [x for x in variable.slotValues if x is not None]
+
+
+def medianOf(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def mixExtreme(variable):
+    if variable.stale:
+        variable.extreme = variable.rescan(validValues(variable))
+        variable.stale = False
+    return variable.extreme
+
+
+def mixAverage(variable):
+    if variable.count == 1:
+        return validValues(variable)[0]
+    return variable.total / variable.count
+
+
+def mixMedian(variable):
+    return medianOf(validValues(variable))
+
+
+def mixRejectOutliers(variable):
+    values = validValues(variable)
+    median = medianOf(values)
+    deviations = [abs(x - median) for x in values]
+    limit = variable.outlierThreshold * medianOf(deviations)
+    kept = [x for x, deviation in zip(values, deviations) if deviation <= limit]
+    if not kept:
+        return median
+    return sum(kept) / len(kept)
+
+
+class PIDState:
+    __slots__ = ("kp", "ki", "kd", "integral", "previousError", "lastTime")
+
+    def __init__(self):
+        self.kp = 0
+        self.ki = 0
+        self.kd = 0
+        self.integral = 0.0
+        self.previousError = 0.0
+        self.lastTime = None
+
+    def setGains(self, kp, ki, kd):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+
+
+def controlBinary(effector, value, target, currentTime):
+    if value > effector.controlData:
+        return 1
+    return 0
+
+
+def controlBinaryInverted(effector, value, target, currentTime):
+    if value > effector.controlData:
+        return 0
+    return 1
+
+
+def controlLookupMin(effector, value, target, currentTime):
+    keys, outputs = effector.controlData
+    position = bisect.bisect_right(keys, value) - 1
+    if position < 0:
+        position = 0
+    return outputs[position]
+
+
+def controlLookupMax(effector, value, target, currentTime):
+    keys, outputs = effector.controlData
+    position = bisect.bisect_left(keys, value)
+    if position == len(keys):
+        position -= 1
+    return outputs[position]
+
+
+def controlLookupClosest(effector, value, target, currentTime):
+    keys, outputs = effector.controlData
+    position = bisect.bisect_left(keys, value)
+    if position == len(keys):
+        position -= 1
+    elif position > 0 and value - keys[position - 1] <= keys[position] - value:
+        position -= 1
+    return outputs[position]
+
+
+def controlPID(effector, value, target, currentTime):
+    if target is None:
+        return effector.shutdownSetting
+    state = effector.state
+    error = target - value
+    integral = state.integral
+    derivative = 0.0
+    if state.lastTime is not None and currentTime > state.lastTime:
+        timeDelta = (currentTime - state.lastTime) / 1000
+        integral += error * timeDelta
+        derivative = (error - state.previousError) / timeDelta
+    state.previousError = error
+    state.lastTime = currentTime
+    output = state.kp * error + state.ki * integral + state.kd * derivative
+    if output > effector.outputHigh:
+        if state.ki * error < 0:
+            state.integral = integral
+        return effector.outputHigh
+    if output < effector.outputLow:
+        if state.ki * error > 0:
+            state.integral = integral
+        return effector.outputLow
+    state.integral = integral
+    return output
+
+
+mixingFunctions = {
+    "min": mixExtreme,
+    "max": mixExtreme,
+    "avg": mixAverage,
+    "median": mixMedian,
+    "rejectOutliers": mixRejectOutliers
+}
+
+mixingExtremes = {
+    "min": (operator.lt, min),
+    "max": (operator.gt, max)
+}
+
+controlFunctions = {
+    "binary": controlBinary,
+    "binaryInverted": controlBinaryInverted,
+    "lookupMin": controlLookupMin,
+    "lookupMax": controlLookupMax,
+    "lookupClosest": controlLookupClosest,
+    "PID": controlPID
+}
+
+controlDataKeys = {
+    "binary": "controlBinaryThreshold",
+    "binaryInverted": "controlBinaryThreshold",
+    "lookupMin": "controlLookupTable",
+    "lookupMax": "controlLookupTable",
+    "lookupClosest": "controlLookupTable",
+    "PID": "controlPIDConsts"
+}
+
+
+class CompiledMeasurer:
+    __slots__ = ("index", "name", "driver", "asyncDriver", "bulkDriver", "channel", "variableIndex", "mixingSlot",
+                 "iterateMS", "offsetMS", "timeoutMS", "active")
+
+    def __init__(self, index, measurerConfig, driver, variableIndex):
+        self.index = index
+        self.name = measurerConfig["name"]
+        self.driver = driver
+        self.asyncDriver = None
+        if inspect.iscoroutinefunction(driver):
+            self.asyncDriver = driver
+            self.driver = lambda: asyncio.run(driver())
+        self.bulkDriver = getattr(driver, "readChannels", None)
+        self.channel = measurerConfig.get("channel", measurerConfig["name"])
+        self.variableIndex = variableIndex
+        self.mixingSlot = None
+        self.iterateMS = measurerConfig["iterateMS"]
+        self.offsetMS = measurerConfig.get("offsetMS", 0)
+        self.timeoutMS = measurerConfig.get("timeoutMS")
+        self.active = measurerConfig["active"]
+
+
+class CompiledVariable:
+    __slots__ = ("index", "name", "mixing", "mixer", "measurerIndices", "slotValues", "count", "total", "extreme",
+                 "stale", "better", "rescan", "outlierThreshold", "checkSafe", "safeLow", "safeHigh", "shutdownRange")
+
+    def __init__(self, index, variableConfig):
+        self.index = index
+        self.name = variableConfig["name"]
+        self.mixing = variableConfig.get("sensorMixing", "avg")
+        self.mixer = mixingFunctions[self.mixing]
+        self.measurerIndices = []
+        self.slotValues = []
+        self.count = 0
+        self.total = 0.0
+        self.extreme = None
+        self.stale = False
+        self.better, self.rescan = mixingExtremes.get(self.mixing, (None, None))
+        self.outlierThreshold = variableConfig.get("outlierThreshold", 3)
+        self.checkSafe = "safeRange" in variableConfig
+        self.safeLow = None
+        self.safeHigh = None
+        if self.checkSafe:
+            self.safeLow, self.safeHigh = sorted(variableConfig["safeRange"])
+        self.shutdownRange = None
+        if "shutdownRange" in variableConfig:
+            self.shutdownRange = tuple(sorted(variableConfig["shutdownRange"]))
+
+    def addMeasurer(self, measurer):
+        measurer.mixingSlot = len(self.measurerIndices)
+        self.measurerIndices.append(measurer.index)
+        self.slotValues.append(None)
+
+    def update(self, slot, value):
+        previous = self.slotValues[slot]
+        self.slotValues[slot] = value
+        if previous is not None:
+            self.count -= 1
+            self.total -= previous
+            if previous == self.extreme:
+                self.stale = True
+        if value is not None:
+            self.count += 1
+            self.total += value
+            if self.better is not None and (self.extreme is None or self.better(value, self.extreme)):
+                self.extreme = value
+        if not self.count:
+            self.total = 0.0
+            self.extreme = None
+            self.stale = False
+
+    def mix(self):
+        if not self.count:
+            return None
+        return self.mixer(self)
+
+
+class CompiledEffector:
+    __slots__ = ("index", "name", "driverKey", "driver", "busDriverKey", "busDriver", "controlType", "controller",
+                 "controlData", "state", "variableIndex", "iterateMS", "offsetMS", "minChangeDelayMS", "active",
+                 "scheduled", "setupValue", "shutdownSetting", "outputLow", "outputHigh")
+
+    def __init__(self, index, effectorConfig, driver, busDriver, variableIndex, stageData):
+        self.index = index
+        self.name = effectorConfig["name"]
+        self.driverKey = effectorConfig["driverKey"]
+        self.driver = driver
+        self.busDriverKey = effectorConfig.get("busDriverKey")
+        self.busDriver = busDriver
+        self.controlType = effectorConfig["controlType"]
+        self.controller = controlFunctions.get(self.controlType)
+        self.controlData = effectorConfig.get(controlDataKeys.get(self.controlType))
+        if self.controlType in ["lookupMin", "lookupMax", "lookupClosest"]:
+            lookupTable = sorted(self.controlData, key=lambda x: x[0])
+            self.controlData = ([x[0] for x in lookupTable], [x[1] for x in lookupTable])
+        self.outputLow, self.outputHigh = sorted(effectorConfig.get("controlOutputRange", [0, 1]))
+        self.state = None
+        self.variableIndex = variableIndex
+        self.iterateMS = effectorConfig.get("iterateMS")
+        self.offsetMS = effectorConfig.get("offsetMS", 0)
+        self.minChangeDelayMS = effectorConfig.get("minChangeDelayMS", 0)
+        self.active = effectorConfig["active"]
+        self.shutdownSetting = effectorConfig["shutdownSetting"]
+        self.scheduled = False
+        self.setupValue = None
+        if stageData["stageEndControl"] == "shutdown":
+            self.setupValue = self.shutdownSetting
+        elif self.controlType == "static":
+            self.setupValue = stageData.get("effectorSettings", {}).get(self.name, self.shutdownSetting)
+        elif self.active:
+            self.scheduled = True
+        else:
+            self.setupValue = self.shutdownSetting
+
+
+class StageEndWatcher:
+    __slots__ = ("conditions", "variableConditions", "satisfied", "satisfiedCount", "requireAll", "holdMS", "changed",
+                 "met")
+
+    def __init__(self, requireAll=True, holdMS=0):
+        self.conditions = []
+        self.variableConditions = {}
+        self.satisfied = []
+        self.satisfiedCount = 0
+        self.requireAll = requireAll
+        self.holdMS = holdMS
+        self.changed = False
+        self.met = False
+
+    def addCondition(self, variableIndex, low, high):
+        self.variableConditions.setdefault(variableIndex, []).append(len(self.conditions))
+        self.conditions.append((variableIndex, low, high))
+        self.satisfied.append(False)
+
+    def prime(self, variableValues):
+        self.satisfiedCount = 0
+        for conditionIndex, (variableIndex, low, high) in enumerate(self.conditions):
+            value = variableValues[variableIndex]
+            self.satisfied[conditionIndex] = value is not None and low <= value <= high
+            self.satisfiedCount += self.satisfied[conditionIndex]
+        self.met = False
+        self.changed = True
+
+    def update(self, variableIndex, value):
+        conditionIndices = self.variableConditions.get(variableIndex)
+        if conditionIndices is None:
+            return
+        for conditionIndex in conditionIndices:
+            variableIndex, low, high = self.conditions[conditionIndex]
+            satisfied = low <= value <= high
+            if satisfied != self.satisfied[conditionIndex]:
+                self.satisfied[conditionIndex] = satisfied
+                self.satisfiedCount += 1 if satisfied else -1
+                self.changed = True
+
+    def evaluate(self, currentTime, scheduler):
+        self.changed = False
+        if self.requireAll:
+            met = self.satisfiedCount == len(self.conditions)
+        else:
+            met = self.satisfiedCount > 0
+        if not self.holdMS:
+            self.met = met
+            return met
+        if met and not self.met:
+            scheduler.schedule(currentTime + self.holdMS, ("hold",))
+        elif self.met and not met:
+            scheduler.cancel(("hold",))
+        self.met = met
+        return False
+
+
+class CompiledStage:
+    __slots__ = ("name", "measurers", "variables", "effectors", "endControl", "endTimer", "endWatcher",
+                 "variableTargets", "recalculateTimers", "bulkReads")
+
+    def __init__(self, name):
+        self.name = name
+        self.measurers = []
+        self.variables = []
+        self.effectors = []
+        self.endControl = None
+        self.endTimer = None
+        self.endWatcher = None
+        self.variableTargets = []
+        self.recalculateTimers = False
+        self.bulkReads = False
+
+
+def compileStage(stageConfig, stageData, deviceDrivers):
+    compiledStage = CompiledStage(stageData["name"])
+    variableIndices = {}
+    for index, variableConfig in enumerate(stageConfig["variables"].values()):
+        variableIndices[variableConfig["name"]] = index
+        compiledStage.variables.append(CompiledVariable(index, variableConfig))
+    for index, measurerConfig in enumerate(stageConfig["measurers"].values()):
+        variableIndex = variableIndices[measurerConfig["variable"]]
+        driver = None
+        if measurerConfig["active"]:
+            driver = deviceDrivers[measurerConfig["driverKey"]]
+        measurer = CompiledMeasurer(index, measurerConfig, driver, variableIndex)
+        compiledStage.measurers.append(measurer)
+        if measurer.active:
+            compiledStage.variables[variableIndex].addMeasurer(measurer)
+            compiledStage.bulkReads = compiledStage.bulkReads or measurer.bulkDriver is not None
+    for index, effectorConfig in enumerate(stageConfig["effectors"].values()):
+        variableIndex = variableIndices.get(effectorConfig.get("controlVariable"))
+        driver = deviceDrivers[effectorConfig["driverKey"]]
+        busDriver = None
+        if "busDriverKey" in effectorConfig:
+            busDriver = deviceDrivers[effectorConfig["busDriverKey"]]
+        compiledStage.effectors.append(CompiledEffector(index, effectorConfig, driver, busDriver, variableIndex,
+                                                        stageData))
+    compiledStage.endControl = stageData["stageEndControl"]
+    endWatcher = StageEndWatcher(stageData.get("stageEndMode", "all") == "all", stageData.get("stageEndHoldMS", 0))
+    if compiledStage.endControl == "time":
+        compiledStage.endTimer = stageData["stageEndTimer"]
+    elif compiledStage.endControl == "target":
+        for variableName, target in stageData["stageEndTarget"].items():
+            if target[0] == "above":
+                endWatcher.addCondition(variableIndices[variableName], target[1], math.inf)
+            else:
+                endWatcher.addCondition(variableIndices[variableName], -math.inf, target[1])
+    elif compiledStage.endControl == "shutdown":
+        for variable in compiledStage.variables:
+            if variable.shutdownRange is not None and variable.measurerIndices:
+                endWatcher.addCondition(variable.index, *variable.shutdownRange)
+    if endWatcher.conditions:
+        compiledStage.endWatcher = endWatcher
+    for variableName, variableTarget in stageData.get("variableTargets", {}).items():
+        compiledStage.variableTargets.append((variableIndices[variableName], variableTarget))
+    compiledStage.recalculateTimers = stageData.get("recalculateTimers", False)
+    return compiledStage
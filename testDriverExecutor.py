@@ -0,0 +1,81 @@
+import time
+import unittest
+
+from driverExecutor import DriverExecutor
+from fakeMachineDriver import delayedDriver, asyncDelayedDriver
+from stageCompiler import CompiledMeasurer
+
+
+class CountingDriver:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def buildMeasurer(index, driver, timeoutMS=None):
+    measurerConfig = {"name": "probe" + str(index), "variable": "temperature", "driverKey": "probe",
+                      "iterateMS": 100, "active": True}
+    if timeoutMS is not None:
+        measurerConfig["timeoutMS"] = timeoutMS
+    return CompiledMeasurer(index, measurerConfig, driver, 0)
+
+
+class DriverExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = DriverExecutor(4, 1000)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def testReadsInParallel(self):
+        measurers = [buildMeasurer(x, delayedDriver(lambda x=x: x * 10, 100)) for x in range(4)]
+        readStart = time.perf_counter()
+        values = self.executor.readMeasurers(measurers)
+        self.assertEqual(values, [0, 10, 20, 30])
+        self.assertLess(time.perf_counter() - readStart, 0.3)
+
+    def testSlowDriverTimesOut(self):
+        measurers = [buildMeasurer(0, delayedDriver(lambda: 1, 300), timeoutMS=50), buildMeasurer(1, lambda: 2)]
+        readStart = time.perf_counter()
+        values = self.executor.readMeasurers(measurers)
+        self.assertEqual(values, [None, 2])
+        self.assertLess(time.perf_counter() - readStart, 0.25)
+        self.assertEqual(self.executor.timeouts, {"probe0": 1})
+
+    def testAsyncDriverTimesOut(self):
+        measurers = [buildMeasurer(0, asyncDelayedDriver(lambda: 1, 300), timeoutMS=50),
+                     buildMeasurer(1, asyncDelayedDriver(lambda: 2, 10))]
+        self.assertEqual(self.executor.readMeasurers(measurers), [None, 2])
+        self.assertEqual(self.executor.timeouts, {"probe0": 1})
+
+    def testPendingReadIsNotResubmitted(self):
+        driver = CountingDriver(5)
+        measurer = buildMeasurer(0, delayedDriver(driver, 200), timeoutMS=20)
+        self.assertEqual(self.executor.readMeasurers([measurer]), [None])
+        self.assertEqual(self.executor.readMeasurers([measurer]), [None])
+        self.assertEqual(self.executor.timeouts, {"probe0": 2})
+        time.sleep(0.3)
+        self.assertEqual(driver.calls, 1)
+        measurer.timeoutMS = 500
+        self.assertEqual(self.executor.readMeasurers([measurer]), [5])
+        self.assertEqual(driver.calls, 2)
+
+    def testBulkGroupTimesOutTogether(self):
+        def readChannels(channels):
+            time.sleep(0.3)
+            return channels
+
+        def driver():
+            return None
+        driver.readChannels = readChannels
+        measurers = [buildMeasurer(x, driver, timeoutMS=50) for x in range(2)]
+        self.assertEqual(self.executor.readMeasurers(measurers), [None, None])
+        self.assertEqual(self.executor.timeouts, {"probe0": 1, "probe1": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import json
+import socket
+import time
+import unittest
+
+from networkEngine import TelemetryServer
+
+
+class TelemetryConnection:
+    def __init__(self, address):
+        self.socket = socket.create_connection(address, timeout=5)
+        self.lines = self.socket.makefile("rb")
+
+    def send(self, command):
+        self.socket.sendall(json.dumps(command).encode() + b"\n")
+
+    def receive(self, messageType=None):
+        while True:
+            line = self.lines.readline()
+            if not line:
+                raise ConnectionError("Telemetry server closed the connection")
+            message = json.loads(line)
+            if messageType is None or message["type"] == messageType:
+                return message
+
+    def close(self):
+        self.lines.close()
+        self.socket.close()
+
+
+class TelemetryServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = TelemetryServer(flushMS=0, maxBufferBytes=4096)
+        self.address = self.server.start()
+        self.connections = []
+
+    def tearDown(self):
+        for connection in self.connections:
+            connection.close()
+        self.server.stop()
+
+    def connect(self):
+        connection = TelemetryConnection(self.address)
+        self.connections.append(connection)
+        return connection
+
+    def waitForClients(self, count):
+        deadline = time.time() + 5
+        while len(self.server.clients) < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def testSubscribeRoundTrip(self):
+        self.server.publish("press", [("variable.temperature", 100, 20.5)])
+        connection = self.connect()
+        connection.send({"subscribe": ["press.variable.*"]})
+        snapshot = connection.receive()
+        self.assertEqual(snapshot, {"type": "snapshot", "values": {"press.variable.temperature": [100, 20.5]}})
+        self.server.publish("press", [("measurer.probe1", 200, 21.0), ("variable.temperature", 200, 21.5)])
+        update = connection.receive()
+        self.assertEqual(update, {"type": "update", "values": {"press.variable.temperature": [200, 21.5]}})
+        connection.send({"unsubscribe": ["press.variable.*"], "subscribe": ["press.measurer.*"]})
+        connection.receive("snapshot")
+        self.server.publish("press", [("variable.temperature", 300, 22.5), ("measurer.probe1", 300, 22.0)])
+        self.assertEqual(connection.receive("update")["values"], {"press.measurer.probe1": [300, 22.0]})
+
+    def testInvalidCommandsGetErrors(self):
+        connection = self.connect()
+        for command in [{"subscribe": "press.*"}, [1], {"rateMS": -1}, {"stats": "yes"}]:
+            connection.send(command)
+            self.assertEqual(connection.receive()["type"], "error")
+        connection.socket.sendall(b"not json\n")
+        self.assertEqual(connection.receive(), {"type": "error", "message": "Invalid JSON"})
+        connection.send({"stats": True})
+        self.assertEqual(connection.receive()["type"], "stats")
+
+    def testSlowClientIsCoalescedNotBuffered(self):
+        slowConnection = self.connect()
+        slowConnection.send({"subscribe": ["press.variable.*"]})
+        slowConnection.receive("snapshot")
+        fastConnection = self.connect()
+        fastConnection.send({"subscribe": ["press.effector.*"]})
+        fastConnection.receive("snapshot")
+        self.waitForClients(2)
+        payload = "x" * 65536
+        publishCount = 400
+        for eventTime in range(publishCount):
+            self.server.publish("press", [("variable.temperature", eventTime, payload)])
+            time.sleep(0.001)
+        self.server.publish("press", [("effector.heater", publishCount, 1)])
+        self.assertEqual(fastConnection.receive("update")["values"], {"press.effector.heater": [publishCount, 1]})
+        slowClient = [x for x in self.server.clients if "press.variable.*" in x.subscriptions][0]
+        self.assertLessEqual(slowClient.writer.transport.get_write_buffer_size(), 4096 + 2 * len(payload))
+        lastTime = None
+        while lastTime != publishCount - 1:
+            lastTime = slowConnection.receive("update")["values"]["press.variable.temperature"][0]
+        slowConnection.send({"stats": True})
+        stats = slowConnection.receive("stats")
+        self.assertGreater(stats["dropped"], 0)
+        self.assertEqual(stats["sent"] + stats["dropped"], publishCount)
+
+
+if __name__ == "__main__":
+    unittest.main()